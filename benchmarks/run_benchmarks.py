@@ -0,0 +1,435 @@
+"""
+Benchmarks of the image recognition engine (testui.support.testui_images).
+
+Screenshots are generated from the images in resources/ and written to
+files, so no device or browser is needed. Only the path based API is used,
+and the cases that need functions a version doesn't have are skipped, so the
+results of two versions, even old releases, can be compared:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --output after.json \
+        --compare before.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root_dir)
+
+# pylint: disable=wrong-import-position
+from testui.support import testui_images
+from testui.support.testui_images import ImageRecognition
+
+RESOLUTIONS = {
+    "720p": (720, 1280),
+    "1080p": (1080, 1920),
+    "1440p": (1440, 3200),
+}
+SCALE_RANGES = {"narrow": (1.2, 0.8), "default": (2.0, 0.3)}
+THREADS = (1, 5)
+
+
+def load_templates() -> dict:
+    """
+    Reference images cut from the images in resources/
+    :return: dict of name to numpy array
+    """
+    comp = cv2.imread(os.path.join(root_dir, "resources", "comp.png"))
+    reco = cv2.imread(os.path.join(root_dir, "resources", "image_reco.png"))
+    return {
+        "icon": comp[100:200, 200:340],
+        "card": reco[50:450, 100:700],
+    }
+
+
+def screenshot(template, resolution, scale=1.5, visible=True):
+    """
+    Synthetic screenshot: random rectangles and text on a light background,
+    with the template pasted in the middle at the given scale
+    :param template: numpy array
+    :param resolution: (width, height)
+    :param scale: scale of the pasted template
+    :param visible: False to leave the template out
+    :return: numpy array
+    """
+    (width, height) = resolution
+    rng = np.random.default_rng(7)
+    image = np.full((height, width, 3), 235, np.uint8)
+    for i in range(width * height // 8000):
+        x = int(rng.integers(0, width - 20))
+        y = int(rng.integers(0, height - 20))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(
+            image, (x, y), (x + int(rng.integers(5, 90)), y + 30), color, -1
+        )
+        cv2.putText(
+            image,
+            f"t{i}",
+            (x, y),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.6,
+            (0, 0, 0),
+            1,
+        )
+    if visible:
+        pasted = cv2.resize(template, None, fx=scale, fy=scale)
+        pasted = pasted[: height // 2, : width // 2]
+        y = height // 3
+        x = width // 4
+        image[y : y + pasted.shape[0], x : x + pasted.shape[1]] = pasted
+    return image
+
+
+def write_video(path, template, resolution=(720, 1280), frames=60):
+    """
+    MP4 where the template only appears in the last 10 frames
+    :param path: where the video is written
+    :param template: numpy array
+    :param resolution: (width, height)
+    :param frames: number of frames
+    """
+    visible = screenshot(template, resolution)
+    hidden = screenshot(template, resolution, visible=False)
+    writer = cv2.VideoWriter(
+        path, cv2.VideoWriter_fourcc(*"mp4v"), 30, resolution
+    )
+    for i in range(frames):
+        frame = (visible if i >= frames - 10 else hidden).copy()
+        cv2.putText(
+            frame,
+            str(i),
+            (20, 40),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            1.2,
+            (0, 0, 0),
+            3,
+        )
+        writer.write(frame)
+    writer.release()
+
+
+def cases(work_dir: str, quick: bool) -> list:
+    """
+    Benchmarked calls, as (name, function, required) tuples. Only the path
+    based API of every release is used, so older versions can be measured
+    too. `required` are the names of the newer testui_images functions or
+    settings a case needs, see supported.
+    :param work_dir: directory for the generated files
+    :param quick: only the smallest resolution and the default scale range
+    :return: list
+    """
+    templates = load_templates()
+    resolutions = {"720p": RESOLUTIONS["720p"]} if quick else RESOLUTIONS
+    scale_ranges = {"default": SCALE_RANGES["default"]}
+    if not quick:
+        scale_ranges = SCALE_RANGES
+    benchmarks = []
+    for template_name, template in templates.items():
+        template_path = os.path.join(work_dir, f"{template_name}.png")
+        cv2.imwrite(template_path, template)
+        for resolution_name, resolution in resolutions.items():
+            prefix = f"{template_name}-{resolution_name}"
+            screen_path = os.path.join(work_dir, f"{prefix}.png")
+            cv2.imwrite(screen_path, screenshot(template, resolution))
+            absent_path = os.path.join(work_dir, f"{prefix}-absent.png")
+            cv2.imwrite(
+                absent_path, screenshot(template, resolution, visible=False)
+            )
+            for range_name, scales in scale_ranges.items():
+                compare = __compare(screen_path, template_path, *scales)
+                benchmarks.append(
+                    (f"compare_images-{prefix}-{range_name}", compare, ())
+                )
+                for threads in THREADS:
+                    benchmarks.append(
+                        (
+                            f"compare_images-{prefix}-{range_name}-"
+                            f"threads{threads}",
+                            __threads(threads, compare),
+                            ("MATCH_THREADS",),
+                        )
+                    )
+            benchmarks.append(
+                (
+                    f"compare_images-{prefix}-not-found",
+                    __compare(absent_path, template_path),
+                    (),
+                )
+            )
+            benchmarks.append(
+                (
+                    f"get_point_match-{prefix}",
+                    lambda screen=screen_path, path=template_path: (
+                        testui_images.get_point_match(screen, path, 0.9)
+                    ),
+                    (),
+                )
+            )
+    benchmarks += helper_cases(work_dir, resolutions, templates["icon"])
+    benchmarks += video_cases(work_dir, templates["icon"])
+    return benchmarks
+
+
+def helper_cases(work_dir: str, resolutions: dict, template) -> list:
+    """
+    Size and crop helpers
+    :param work_dir: directory for the generated files
+    :param resolutions: dict of name to (width, height)
+    :param template: numpy array pasted in the screenshots
+    :return: list of (name, function, required) tuples
+    """
+    benchmarks = []
+    for name, resolution in resolutions.items():
+        path = os.path.join(work_dir, f"screen-{name}.png")
+        cv2.imwrite(path, screenshot(template, resolution))
+        crop_path = os.path.join(work_dir, "cropped.png")
+        region = (100, 200, resolution[0] // 2, resolution[1] // 3)
+        benchmarks += [
+            (f"size-{name}", lambda path=path: testui_images.size(path), ()),
+            (
+                f"image_original_size-{name}",
+                lambda path=path: ImageRecognition(
+                    path, path=""
+                ).image_original_size(),
+                (),
+            ),
+            (
+                f"crop_original_image-{name}",
+                lambda path=path, crop_path=crop_path: ImageRecognition(
+                    path, path=""
+                ).crop_original_image(300, 400, 200, 300, crop_path),
+                (),
+            ),
+            (
+                f"crop_region-{name}",
+                lambda path=path, region=region: testui_images.crop_region(
+                    cv2.imread(path), region
+                ),
+                ("crop_region",),
+            ),
+        ]
+    return benchmarks
+
+
+def video_cases(work_dir: str, template) -> list:
+    """
+    Search of the template in generated videos
+    :param work_dir: directory for the generated files
+    :param template: numpy array
+    :return: list of (name, function, required) tuples
+    """
+    cv2.imwrite(os.path.join(work_dir, "video-template.png"), template)
+    write_video(os.path.join(work_dir, "video.mp4"), template)
+    return [
+        (
+            "compare_video_image-720p",
+            lambda: ImageRecognition(
+                "video.mp4", "video-template.png", 0.9, path=work_dir
+            ).compare_video(),
+            (),
+        ),
+        (
+            "compare_video_image_parallel-720p-processes2",
+            lambda: testui_images.compare_video_image_parallel(
+                "video.mp4",
+                "video-template.png",
+                0.9,
+                "",
+                path=work_dir,
+                processes=2,
+            ),
+            ("compare_video_image_parallel",),
+        ),
+    ]
+
+
+def supported(required) -> bool:
+    """
+    Whether the installed testui_images has everything a case needs
+    :param required: names of functions or settings of testui_images
+    :return: bool
+    """
+    return all(hasattr(testui_images, name) for name in required)
+
+
+def __compare(screen_path, template_path, max_scale=2.0, min_scale=0.3):
+    """
+    ImageRecognition.compare of two files
+    :param screen_path: path of the screenshot
+    :param template_path: path of the reference image
+    :param max_scale: the maximum scale of the search
+    :param min_scale: the minimum scale of the search
+    :return: function
+    """
+
+    def call():
+        return ImageRecognition(
+            screen_path, template_path, 0.9, path=""
+        ).compare("", max_scale, min_scale)
+
+    return call
+
+
+def __threads(threads, function):
+    """
+    Wraps a call so it runs with the given number of match threads
+    :param threads: value of testui_images.MATCH_THREADS during the call
+    :param function: function to call
+    :return: function
+    """
+
+    def call():
+        default = testui_images.MATCH_THREADS
+        testui_images.MATCH_THREADS = threads
+        try:
+            return function()
+        finally:
+            testui_images.MATCH_THREADS = default
+
+    return call
+
+
+def measure(function, repeat: int) -> dict:
+    """
+    Runs the function `repeat` times, after a warm up call
+    :param function: function to measure
+    :param repeat: number of measured calls
+    :return: dict with the min, median and mean seconds
+    """
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            function()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function()
+                timings.append(time.perf_counter() - start)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "repeat": repeat,
+    }
+
+
+def metadata() -> dict:
+    """
+    Environment of the run, to know what is being compared
+    :return: dict
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=root_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ""
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+    }
+
+
+def compare(results: dict, baseline_path: str, tolerance: float) -> int:
+    """
+    Prints the change of every benchmark against a previous run
+    :param results: results of this run
+    :param baseline_path: JSON file of the previous run
+    :param tolerance: ratio of the medians over which a change is reported
+    as a regression
+    :return: number of regressions
+    """
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = json.load(file)["results"]
+    regressions = 0
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["median"] / max(baseline[name]["median"], 1e-9)
+        flag = ""
+        if ratio > tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(
+            f"{name:70} {baseline[name]['median']:9.4f}s -> "
+            f"{result['median']:9.4f}s  x{ratio:5.2f}{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--output", default="benchmark-results.json", help="JSON results"
+    )
+    parser.add_argument(
+        "--compare", default="", help="JSON results of a previous run"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.2,
+        help="slowdown ratio reported as a regression",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--filter", default="", help="only run benchmarks containing this"
+    )
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="only the smallest resolution and the default scale range",
+    )
+    arguments = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, function, required in cases(work_dir, arguments.quick):
+            if arguments.filter not in name:
+                continue
+            if not supported(required):
+                print(f"{name:70} skipped, needs {', '.join(required)}")
+                continue
+            try:
+                results[name] = measure(function, arguments.repeat)
+            except Exception as error:  # pylint: disable=broad-except
+                print(f"{name:70} skipped, {type(error).__name__}: {error}")
+                continue
+            print(f"{name:70} {results[name]['median']:9.4f}s")
+
+    with open(arguments.output, "w", encoding="utf-8") as file:
+        json.dump(
+            {"meta": metadata(), "results": results},
+            file,
+            indent=2,
+            sort_keys=True,
+        )
+    print(f"Results saved in {arguments.output}")
+    if arguments.compare:
+        if compare(results, arguments.compare, arguments.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
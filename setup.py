@@ -47,5 +47,6 @@ setup(
         "webdriver-manager~=4.0.1",
         "numpy~=1.26",
         "imutils~=0.5.4",
+        "lxml>=4.9",
     ],
 )
@@ -0,0 +1,29 @@
+import cv2
+import numpy as np
+
+from testui.support.artifact_writer import ArtifactWriter
+
+
+class TestArtifactWriter:
+    def test_artifacts_are_written_on_flush(self, tmp_path):
+        writer = ArtifactWriter(max_size=2)
+        image = np.zeros((20, 30, 3), np.uint8)
+        image[5:10, 5:10] = 255
+        for i in range(5):
+            writer.write(str(tmp_path / "shots" / f"{i}.png"), image)
+        writer.write(str(tmp_path / "source.xml"), "<hierarchy/>")
+        writer.write(str(tmp_path / "raw.bin"), b"\x00\x01")
+        writer.flush()
+        for i in range(5):
+            saved = cv2.imread(str(tmp_path / "shots" / f"{i}.png"))
+            assert np.array_equal(saved, image)
+        assert (tmp_path / "source.xml").read_text() == "<hierarchy/>"
+        assert (tmp_path / "raw.bin").read_bytes() == b"\x00\x01"
+
+    def test_failed_write_does_not_stop_the_worker(self, tmp_path):
+        writer = ArtifactWriter()
+        (tmp_path / "file").write_text("")
+        writer.write(str(tmp_path / "file" / "not-a-dir.png"), b"")
+        writer.write(str(tmp_path / "ok.txt"), "ok")
+        writer.flush()
+        assert (tmp_path / "ok.txt").read_text() == "ok"
@@ -0,0 +1,232 @@
+import pytest
+
+from testui.elements.testui_collection import CollectionException, ee
+from testui.elements.testui_element import Elements
+from testui.support.attribute_reader import AttributeReader, MISSING
+from testui.support.configuration import Configuration
+from testui.support.page_source import PageSource
+
+SOURCE = """<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>
+<hierarchy index="0" rotation="0">
+  <android.widget.FrameLayout class="android.widget.FrameLayout"
+      package="com.app">
+    <android.widget.TextView class="android.widget.TextView"
+        package="com.app" resource-id="com.app:id/title" text="Title" />
+    <android.widget.CheckBox class="android.widget.CheckBox"
+        package="com.app" resource-id="com.app:id/box" checked="true" />
+  </android.widget.FrameLayout>
+</hierarchy>
+"""
+
+
+class FakeElement:
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+    def get_attribute(self, name):
+        return self.attributes.get(name)
+
+    def is_displayed(self):
+        return True
+
+
+class FakeDriver:
+    """
+    Appium driver with the elements of SOURCE, found by their locator
+    """
+
+    def __init__(self):
+        self.elements = {
+            "title": FakeElement({"text": "Title", "name": "Title"}),
+            "box": FakeElement({"checked": "true"}),
+            'text("Title")': FakeElement({"text": "Title"}),
+            "//*[matches(@text, 'T.*')]": FakeElement({"text": "Title"}),
+        }
+        self.current_context = "NATIVE_APP"
+        self.page_source = SOURCE
+        self.find_requests = 0
+        self.script_results = None
+
+    def find_element(self, by=None, value=None):
+        _ = by
+        self.find_requests += 1
+        if value not in self.elements:
+            raise Exception(f"{value} not found")
+        return self.elements[value]
+
+    def find_elements(self, by=None, value=None):
+        _ = by
+        self.find_requests += 1
+        if value not in self.elements:
+            return []
+        return [self.elements[value]]
+
+    def execute_script(self, script, requests):
+        _ = script, requests
+        if self.script_results is None:
+            raise Exception("no javascript")
+        return self.script_results
+
+
+class FakeTestUIDriver:
+    def __init__(self, browser=False):
+        self.driver = FakeDriver()
+        self.browser = browser
+        self.configuration = Configuration()
+        self.configuration.save_screenshot_on_fail = False
+        self.configuration.save_full_stacktrace = False
+        self.logger_name = None
+        self.soft_assert = False
+        self.device_name = "Device"
+        self.page_sources = 0
+        self.errors = []
+
+    def get_driver(self):
+        return self.driver
+
+    def get_page_source_snapshot(self, refresh=False):
+        _ = refresh
+        self.page_sources += 1
+        return PageSource.parse(self.driver.page_source)
+
+    def set_error(self, error):
+        self.errors.append(error)
+
+
+def elements(driver, *locators):
+    return [
+        Elements(driver, locator_type, locator)
+        for locator_type, locator in locators
+    ]
+
+
+class TestAttributeReader:
+    def test_native_elements_are_read_one_by_one_by_default(self):
+        driver = FakeTestUIDriver()
+        values = AttributeReader(driver).read(
+            elements(driver, ("id", "title"), ("id", "missing")),
+            ["text", None],
+        )
+        assert values == ["Title", MISSING]
+        assert driver.page_sources == 0
+        assert driver.driver.find_requests == 2
+
+    def test_native_elements_are_read_from_one_page_source(self):
+        driver = FakeTestUIDriver()
+        driver.configuration.page_source_snapshot = True
+        found = elements(
+            driver,
+            ("id", "title"),
+            ("id", "box"),
+            ("className", "android.widget.Button"),
+            ("xpath", "//*[@checked='true']"),
+        )
+        values = AttributeReader(driver).read(
+            found, ["text", "checked", None, "resourceId"]
+        )
+        assert values == ["Title", "true", MISSING, "com.app:id/box"]
+        assert driver.page_sources == 1
+        assert driver.driver.find_requests == 0
+
+    def test_attributes_missing_in_the_page_source_are_read_one_by_one(self):
+        driver = FakeTestUIDriver()
+        driver.configuration.page_source_snapshot = True
+        found = elements(
+            driver, ("id", "title"), ("uiautomator", 'text("Title")')
+        )
+        values = AttributeReader(driver).read(found, ["name", "text"])
+        assert values == ["Title", "Title"]
+        assert driver.page_sources == 1
+        assert driver.driver.find_requests == 2
+
+    def test_web_elements_are_read_with_one_script(self):
+        driver = FakeTestUIDriver(browser=True)
+        driver.driver.script_results = [
+            {"value": "Title"},
+            {"missing": True},
+            {"unsupported": True},
+        ]
+        found = elements(
+            driver,
+            ("css", "#title"),
+            ("css", "#missing"),
+            ("uiautomator", 'text("Title")'),
+        )
+        values = AttributeReader(driver).read(found, ["text"] * 3)
+        assert values == ["Title", MISSING, "Title"]
+        assert driver.driver.find_requests == 1
+
+    def test_web_elements_are_read_one_by_one_without_javascript(self):
+        driver = FakeTestUIDriver(browser=True)
+        found = elements(driver, ("id", "title"), ("id", "box"))
+        values = AttributeReader(driver).read(found, ["text", "checked"])
+        assert values == ["Title", "true"]
+
+
+class TestCollections:
+    def test_wait_until_attribute(self):
+        driver = FakeTestUIDriver()
+        driver.configuration.page_source_snapshot = True
+        collection = ee(*elements(driver, ("id", "title"), ("id", "box")))
+        collection.wait_until_attribute(["text", "checked"], ["Title", "true"])
+        with pytest.raises(CollectionException) as error:
+            collection.wait_until_attribute(
+                ["text", "checked"], ["Other", "true"], seconds=0.3
+            )
+        message = error.value.message
+        assert '"id: title" attribute "text" -> "Title"' in message
+        assert '"id: box"' not in message
+
+    def test_wait_until_attribute_with_no(self):
+        driver = FakeTestUIDriver()
+        title, box = elements(driver, ("id", "title"), ("id", "box"))
+        ee(title.no(), box).wait_until_attribute(
+            ["text", "checked"], ["Other", "true"]
+        )
+        with pytest.raises(CollectionException) as error:
+            ee(title.no(), box).wait_until_attribute(
+                ["text", "checked"], ["Title", "true"], seconds=0.3
+            )
+        assert "should not have been" in error.value.message
+        # no() only applies to the next check
+        ee(title, box).wait_until_attribute(
+            ["text", "checked"], ["Title", "true"]
+        )
+
+    def test_wait_until_all_exist_with_no(self):
+        driver = FakeTestUIDriver()
+        driver.configuration.page_source_snapshot = True
+        title, missing = elements(driver, ("id", "title"), ("id", "missing"))
+        ee(title, missing.no()).wait_until_all_exist()
+        with pytest.raises(CollectionException) as error:
+            ee(title, missing).wait_until_all_exist(seconds=0.3)
+        assert '"id: missing" not found' in error.value.message
+        with pytest.raises(CollectionException) as error:
+            ee(title.no(), missing.no()).wait_until_all_exist(seconds=0.3)
+        assert '"id: title" found' in error.value.message
+
+
+class TestFindByAttribute:
+    @pytest.mark.parametrize("snapshot", [False, True])
+    def test_attributes_missing_in_the_page_source(self, snapshot):
+        driver = FakeTestUIDriver()
+        driver.configuration.page_source_snapshot = snapshot
+        title = Elements(driver, "id", "title")
+        assert title.find_by_attribute("name", "Title", timeout=1).index == 0
+        assert driver.page_sources == (1 if snapshot else 0)
+
+    def test_attributes_of_the_page_source(self):
+        driver = FakeTestUIDriver()
+        driver.configuration.page_source_snapshot = True
+        box = Elements(driver, "id", "box")
+        assert box.find_by_attribute("checked", "true", timeout=1).index == 0
+        assert driver.page_sources == 1
+        # only wait_until_visible reads the element itself
+        assert driver.driver.find_requests == 1
+
+    def test_xpath_not_supported_by_lxml(self):
+        driver = FakeTestUIDriver()
+        driver.configuration.page_source_snapshot = True
+        title = Elements(driver, "xpath", "//*[matches(@text, 'T.*')]")
+        assert title.find_by_attribute("text", "Title", timeout=1).index == 0
+        assert driver.page_sources == 1
@@ -0,0 +1,58 @@
+from testui.support.page_source import PageSource
+
+ANDROID_SOURCE = """<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>
+<hierarchy index="0" rotation="0">
+  <android.widget.FrameLayout class="android.widget.FrameLayout"
+      package="com.app">
+    <android.widget.TextView class="android.widget.TextView"
+        package="com.app" resource-id="android:id/title" text="Bar" />
+    <android.widget.TextView class="android.widget.TextView"
+        package="com.app" resource-id="com.app:id/title" text="First"
+        content-desc="first" />
+    <android.widget.TextView class="android.widget.TextView"
+        package="com.app" resource-id="com.app:id/title" text="Second"
+        checked="true" />
+    <android.widget.Button class="android.widget.Button"
+        package="com.app" resource-id="com.app:id/ok" text="OK" />
+  </android.widget.FrameLayout>
+</hierarchy>
+"""
+
+IOS_SOURCE = """<?xml version="1.0" encoding="UTF-8"?>
+<AppiumAUT>
+  <XCUIElementTypeApplication name="App">
+    <XCUIElementTypeButton name="login" label="Log in" visible="true" />
+    <XCUIElementTypeStaticText name="title" value="Welcome" />
+  </XCUIElementTypeApplication>
+</AppiumAUT>
+"""
+
+
+class TestPageSource:
+    def test_android_locators_and_attributes(self):
+        source = PageSource.parse(ANDROID_SOURCE)
+        titles = source.find("id", "title")
+        assert [source.attribute(node, "text") for node in titles] == [
+            "First",
+            "Second",
+        ]
+        assert source.find("id", "com.app:id/ok")[0].get("text") == "OK"
+        # like Appium, ids with a package are matched as they are
+        (bar,) = source.find("id", "android:id/title")
+        assert bar.get("text") == "Bar"
+        assert source.attribute(titles[0], "contentDescription") == "first"
+        assert source.attribute(titles[1], "content-desc") is None
+        assert len(source.find("className", "android.widget.TextView")) == 3
+        assert len(source.find("xpath", "//*[@checked='true']")) == 1
+        assert source.find("uiautomator", 'text("OK")') is None
+
+    def test_ios_locators(self):
+        source = PageSource.parse(IOS_SOURCE)
+        assert source.platform == "ios"
+        (button,) = source.find("accessibility", "login")
+        assert source.attribute(button, "label") == "Log in"
+        assert len(source.find("className", "XCUIElementTypeStaticText")) == 1
+
+    def test_web_views_are_not_parsed(self):
+        assert PageSource.parse("<html><body><p>text</body></html>") is None
+        assert PageSource.parse("<!DOCTYPE html><html><br></html>") is None
@@ -0,0 +1,360 @@
+import os
+import tempfile
+import time
+import types
+
+import cv2
+import numpy as np
+import pytest
+
+from testui.elements.testui_element import e
+from testui.support.configuration import Configuration
+from testui.support.testui_driver import TestUIDriver
+
+test_dir = os.path.dirname(__file__)
+
+
+class FakeWebElement:
+    """
+    Element at (100, 200) of 300x150, which can't take its own screenshot
+    """
+
+    def __init__(self):
+        self.location = {"x": 100, "y": 200}
+        self.size = {"width": 300, "height": 150}
+        self.keys = []
+
+    @property
+    def screenshot_as_png(self):
+        raise Exception("element screenshots are not supported")
+
+    def is_displayed(self):
+        return True
+
+    def click(self):
+        pass
+
+    def send_keys(self, value):
+        self.keys.append(value)
+
+
+class FakeWebDriver:
+    """
+    Appium driver showing a numpy array as its screen, which records the
+    screenshots taken and the points clicked. Screens in `upcoming` are
+    shown by the next screenshots before `screen`.
+    """
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.upcoming = []
+        self.screenshots = 0
+        self.window_sizes = 0
+        self.clicks = []
+        self.element = FakeWebElement()
+
+    def find_element(self, by=None, value=None):
+        _ = by, value
+        return self.element
+
+    def get_screenshot_as_png(self):
+        self.screenshots += 1
+        screen = self.upcoming.pop(0) if self.upcoming else self.screen
+        return cv2.imencode(".png", screen)[1].tobytes()
+
+    def get_window_size(self):
+        self.window_sizes += 1
+        return {"width": self.screen.shape[1], "height": self.screen.shape[0]}
+
+    def execute(self, command, params=None):
+        if command == "actions":
+            for action in params["actions"][0]["actions"]:
+                if action["type"] == "pointerMove":
+                    self.clicks.append((action["x"], action["y"]))
+        return {"value": None}
+
+
+def fake_testui_driver(screen, **configuration):
+    """
+    TestUIDriver of a FakeWebDriver
+    :param screen: numpy array shown by the driver
+    :param configuration: values of the Configuration properties
+    :return: (TestUIDriver, FakeWebDriver)
+    """
+    config = Configuration()
+    config.save_screenshot_on_fail = False
+    for name, value in configuration.items():
+        setattr(config, name, value)
+    fake = FakeWebDriver(screen)
+    driver = TestUIDriver(
+        types.SimpleNamespace(
+            soft_assert=False,
+            get_driver=lambda: fake,
+            process=None,
+            appium_port=0,
+            browser=False,
+            logger_name=None,
+            udid=None,
+            device_name="Device",
+            file_name=None,
+            configuration=config,
+        )
+    )
+    return driver, fake
+
+
+@pytest.fixture(name="template")
+def template_fixture(tmp_path):
+    comp = cv2.imread(os.path.join(test_dir, "..", "resources", "comp.png"))
+    template = comp[100:200, 200:340].copy()
+    template_path = str(tmp_path / "template.png")
+    cv2.imwrite(template_path, template)
+    return template, template_path
+
+
+def _screen(template, *positions):
+    """720x1280 screen with the template pasted at each (x, y) position"""
+    screen = np.full((1280, 720, 3), 235, np.uint8)
+    cv2.putText(
+        screen,
+        "static text",
+        (40, 1000),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        1.5,
+        (0, 0, 0),
+        3,
+    )
+    for x, y in positions:
+        screen[y : y + template.shape[0], x : x + template.shape[1]] = template
+    return screen
+
+
+class TestClickByImage:
+    def test_index_selects_each_occurrence(self, template):
+        image, path = template
+        screen = _screen(image, (400, 100), (60, 600), (60, 100))
+        driver, fake = fake_testui_driver(screen)
+        for index in range(3):
+            driver.click_by_image(path, index=index)
+        driver.click_by_image(path)
+        centers = [(130, 150), (470, 150), (130, 650)]
+        assert len(fake.clicks) == 4
+        for (x, y), (center_x, center_y) in zip(fake.clicks[:3], centers):
+            assert abs(x - center_x) <= 2 and abs(y - center_y) <= 2
+        # without index the best match is clicked, any of them
+        x, y = fake.clicks[3]
+        assert any(
+            abs(x - center_x) <= 2 and abs(y - center_y) <= 2
+            for center_x, center_y in centers
+        )
+        with pytest.raises(Exception):
+            driver.click_by_image(path, index=3)
+
+
+class TestImageRegion:
+    def test_element_region_is_converted_to_screenshot_pixels(self, template):
+        image, path = template
+        screen = _screen(image, (400, 100), (60, 600))
+        driver, _ = fake_testui_driver(screen)
+        # bounds of an element in click coordinates, half the screenshot
+        element = types.SimpleNamespace(
+            location=types.SimpleNamespace(x=190, y=40),
+            dimensions=types.SimpleNamespace(x=100, y=80),
+        )
+        occurrences = driver.find_image_occurrences(
+            path, region=element, ratio=0.5
+        )
+        assert len(occurrences) == 1
+        x, y = occurrences[0]
+        assert abs(x - 470) <= 2 and abs(y - 150) <= 2
+        assert driver.find_image_match(path, region=element, ratio=0.5)
+        matches = driver.find_image_matches([path], region=element, ratio=0.5)
+        assert matches[path]["found"]
+
+
+class TestScreenshotCache:
+    def test_screenshot_is_reused_within_the_ttl(self):
+        driver, fake = fake_testui_driver(
+            _screen(None), screenshot_cache_ttl=60
+        )
+        png = driver.get_screenshot_as_png()
+        assert driver.get_screenshot_as_png() is png
+        assert driver.get_screenshot_as_image().shape == (1280, 720, 3)
+        assert fake.screenshots == 1
+
+    def test_screenshot_expires_after_the_ttl(self):
+        driver, fake = fake_testui_driver(
+            _screen(None), screenshot_cache_ttl=0.1
+        )
+        driver.get_screenshot_as_png()
+        time.sleep(0.15)
+        driver.get_screenshot_as_png()
+        assert fake.screenshots == 2
+
+    def test_screenshot_is_not_cached_without_ttl(self):
+        driver, fake = fake_testui_driver(_screen(None))
+        driver.get_screenshot_as_png()
+        driver.get_screenshot_as_png()
+        assert fake.screenshots == 2
+
+    def test_actions_invalidate_the_screenshot(self):
+        driver, fake = fake_testui_driver(
+            _screen(None), screenshot_cache_ttl=60
+        )
+        element = e(driver, "id", "button")
+        actions = [
+            lambda: driver.click(10, 10),
+            element.click,
+            lambda: element.send_keys("text"),
+        ]
+        driver.get_screenshot_as_png()
+        for number, action in enumerate(actions):
+            action()
+            driver.get_screenshot_as_png()
+            driver.get_screenshot_as_png()
+            assert fake.screenshots == number + 2
+        assert fake.element.keys == ["text"]
+
+    def test_elements_are_cropped_from_the_cached_screen(self):
+        screen = np.random.default_rng(3).integers(
+            0, 255, (1280, 720, 3), np.uint8
+        )
+        driver, fake = fake_testui_driver(screen, screenshot_cache_ttl=60)
+        driver.get_screenshot_as_image()
+        cropped = e(driver, "id", "button").screenshot_as_image()
+        assert fake.screenshots == 1
+        assert np.array_equal(cropped, screen[200:350, 100:400])
+
+
+class TestTapImage:
+    def test_taps_once_on_the_match(self, template):
+        image, path = template
+        driver, fake = fake_testui_driver(_screen(image, (400, 100)))
+        result = driver.tap_image(path)
+        assert result["found"]
+        assert result["attempts"] == 1
+        assert fake.clicks == [result["point"]]
+        x, y = result["point"]
+        assert abs(x - 470) <= 2 and abs(y - 150) <= 2
+
+    def test_retries_until_the_image_appears(self, template):
+        image, path = template
+        # small screens keep the searches that don't find the image short
+        blank = np.full((120, 120, 3), 235, np.uint8)
+        screen = np.full((640, 360, 3), 235, np.uint8)
+        screen[300:400, 100:240] = image
+        driver, fake = fake_testui_driver(screen, screenshot_cache_ttl=60)
+        fake.upcoming = [blank, blank]
+        result = driver.tap_image(path, timeout=30)
+        assert result["found"]
+        assert result["attempts"] == 3
+        # new screenshots are taken after waiting 0.2s and 0.4s
+        assert fake.screenshots == 3
+        assert result["duration"] >= 0.6
+        assert len(fake.clicks) == 1
+
+    def test_gives_up_after_the_timeout(self, template):
+        _, path = template
+        blank = np.full((120, 120, 3), 235, np.uint8)
+        driver, fake = fake_testui_driver(blank, screenshot_cache_ttl=60)
+        result = driver.tap_image(path, timeout=1, assertion=False)
+        assert not result["found"]
+        assert result["point"] is None
+        assert fake.clicks == []
+        assert result["duration"] >= 1
+        # waits of 0.2s, 0.4s and the remaining 0.4s
+        assert 3 <= result["attempts"] <= 4
+        assert fake.screenshots == result["attempts"]
+        with pytest.raises(Exception):
+            driver.tap_image(path)
+        assert fake.clicks == []
+
+
+class TestDimensions:
+    def test_dimensions_are_read_once(self):
+        driver, fake = fake_testui_driver(_screen(None))
+        for _ in range(3):
+            assert driver.get_dimensions().x == 720
+        assert fake.screenshots == 1
+        assert fake.window_sizes == 1
+
+    def test_rotation_invalidates_the_dimensions(self):
+        driver, fake = fake_testui_driver(_screen(None))
+        dimensions = driver.get_dimensions()
+        assert (dimensions.x, dimensions.y) == (720, 1280)
+        # actions check the window size again, which is unchanged
+        driver.click(10, 10)
+        driver.get_dimensions()
+        assert fake.window_sizes == 2
+        assert fake.screenshots == 1
+        fake.screen = np.full((720, 1280, 3), 235, np.uint8)
+        driver.invalidate_snapshots()
+        dimensions = driver.get_dimensions()
+        assert (dimensions.x, dimensions.y) == (1280, 720)
+        assert fake.screenshots == 2
+
+
+class TestScreenStable:
+    def test_waits_for_consecutive_unchanged_screenshots(self):
+        screens = [
+            np.full((640, 360, 3), value, np.uint8) for value in (0, 80, 160)
+        ]
+        driver, fake = fake_testui_driver(screens[-1] + 90)
+        fake.upcoming = screens
+        assert driver.wait_until_screen_stable(window=3, timeout=10)
+        # 3 changing screenshots, the first stable one and 3 more like it
+        assert fake.screenshots == 7
+
+    def test_differences_within_the_threshold_are_stable(self):
+        screen = np.full((640, 360, 3), 100, np.uint8)
+        driver, fake = fake_testui_driver(screen)
+        fake.upcoming = [screen + 1, screen] * 2
+        assert driver.wait_until_screen_stable(threshold=1.0, window=3)
+        assert fake.screenshots == 4
+
+    def test_timeout_while_the_screen_keeps_changing(self):
+        screens = [np.full((64, 36, 3), value, np.uint8) for value in (0, 200)]
+        driver, fake = fake_testui_driver(screens[0])
+        fake.upcoming = screens * 10000
+        start = time.time()
+        assert not driver.wait_until_screen_stable(timeout=0.5, assertion=False)
+        assert time.time() - start >= 0.5
+        with pytest.raises(Exception):
+            driver.wait_until_screen_stable(timeout=0.5)
+        assert fake.screenshots > 2
+
+
+class TestInMemoryScreenshots:
+    def test_screenshots_are_not_written_to_disk(
+        self, template, tmp_path, monkeypatch
+    ):
+        image, path = template
+        decoded = []
+        imdecode = cv2.imdecode
+
+        def spy_imdecode(*args):
+            decoded.append(args)
+            return imdecode(*args)
+
+        def fail_imwrite(*args):
+            raise AssertionError(f"{args[0]} written to disk")
+
+        monkeypatch.setattr(cv2, "imdecode", spy_imdecode)
+        monkeypatch.setattr(cv2, "imwrite", fail_imwrite)
+        for directory in ("cwd", "screenshots", "tmp"):
+            (tmp_path / directory).mkdir()
+        monkeypatch.chdir(tmp_path / "cwd")
+        monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+        driver, _ = fake_testui_driver(
+            _screen(image, (400, 100)),
+            screenshot_path=str(tmp_path / "screenshots"),
+        )
+        assert driver.get_screenshot_as_image().shape == (1280, 720, 3)
+        assert driver.get_dimensions().x == 720
+        assert driver.find_image_match(path)
+        driver.click_by_image(path)
+        assert len(decoded) == 3
+        # only the text logs of the run are written
+        for directory in ("cwd", "screenshots", "tmp"):
+            for root, _, files in os.walk(tmp_path / directory):
+                assert not files or os.path.basename(root) == "logs"
@@ -0,0 +1,508 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from testui.support import testui_images
+from testui.support.testui_images import ImageRecognition
+
+
+test_dir = os.path.dirname(__file__)
+
+
+def _screen(template, scale=1.5, x=120, y=700, size=(720, 1280)):
+    """Synthetic screenshot with the template pasted at (x, y)"""
+    rng = np.random.default_rng(7)
+    (width, height) = size
+    image = np.full((height, width, 3), 235, np.uint8)
+    for i in range(width * height // 7680):
+        start = rng.integers(0, width - 20), rng.integers(0, height - 20)
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(
+            image,
+            (int(start[0]), int(start[1])),
+            (int(start[0] + rng.integers(5, 90)), int(start[1] + 30)),
+            color,
+            -1,
+        )
+        cv2.putText(
+            image, f"t{i}", (int(start[0]), int(start[1])),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1,
+        )
+    pasted = cv2.resize(template, None, fx=scale, fy=scale)
+    image[y : y + pasted.shape[0], x : x + pasted.shape[1]] = pasted
+    return image
+
+
+@pytest.fixture(name="images")
+def images_fixture(tmp_path):
+    comp = cv2.imread(os.path.join(test_dir, "..", "resources", "comp.png"))
+    template = comp[100:200, 200:340]
+    screen = _screen(template)
+    screen_path = str(tmp_path / "screen.png")
+    template_path = str(tmp_path / "template.png")
+    cv2.imwrite(screen_path, screen)
+    cv2.imwrite(template_path, template)
+    return screen_path, template_path
+
+
+class TestImageRecognition:
+    def test_compare_finds_scaled_template(self, images):
+        screen_path, template_path = images
+        found, score = ImageRecognition(
+            screen_path, template_path, 0.9, path=""
+        ).compare()
+        assert found
+        assert score > 0.9
+
+    def test_compare_not_found(self, images, tmp_path):
+        screen_path, _ = images
+        other = np.zeros((80, 80, 3), np.uint8)
+        cv2.circle(other, (40, 40), 30, (10, 200, 30), -1)
+        other_path = str(tmp_path / "other.png")
+        cv2.imwrite(other_path, other)
+        found, score = testui_images.compare_images(
+            screen_path, other_path, 0.9
+        )
+        assert not found
+        assert score < 0.9
+
+    def test_point_match_is_template_center(self, images):
+        screen_path, template_path = images
+        x, y = testui_images.get_point_match(screen_path, template_path)
+        assert abs(x - (120 + 105)) <= 4
+        assert abs(y - (700 + 75)) <= 4
+
+    def test_concurrent_matches_do_not_share_state(self, images):
+        screen_path, template_path = images
+        screen = cv2.imread(screen_path)
+        template = cv2.imread(template_path)
+        absent = np.zeros((80, 80, 3), np.uint8)
+        cv2.circle(absent, (40, 40), 30, (10, 200, 30), -1)
+        results = {}
+
+        def match(number, image):
+            results[number] = testui_images.pyramid_match(screen, image, 0.9)
+
+        threads = [
+            threading.Thread(
+                target=match, args=(i, template if i % 2 else absent)
+            )
+            for i in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for number, result in results.items():
+            assert (result.score > 0.9) == bool(number % 2)
+
+    def test_template_cache_reuses_reference_images(self, images):
+        screen_path, template_path = images
+        cache = testui_images.TemplateCache(max_size=1)
+        first = cache.get(template_path)
+        assert cache.get(template_path) is first
+        os.utime(template_path, (0, 0))
+        assert cache.get(template_path) is not first
+        cache.get(screen_path)
+        assert cache.stats() == {
+            "hits": 1,
+            "misses": 3,
+            "evictions": 1,
+            "size": 1,
+            "max_size": 1,
+        }
+
+    def test_video_match_in_last_frames(self, images, tmp_path):
+        screen_path, template_path = images
+        screen = cv2.imread(screen_path)
+        blank = screen.copy()
+        blank[690:860, 110:340] = 235
+        video_path = str(tmp_path / "video.mp4")
+        writer = cv2.VideoWriter(
+            video_path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (720, 1280)
+        )
+        for i in range(40):
+            writer.write(screen if i >= 35 else blank)
+        writer.release()
+        found, score = testui_images.compare_video_image(
+            "video.mp4", "template.png", 0.9, "", path=str(tmp_path)
+        )
+        assert found
+        assert score > 0.9
+
+    def test_video_match_of_small_icon(self, tmp_path):
+        comp = cv2.imread(
+            os.path.join(test_dir, "..", "resources", "comp.png")
+        )
+        icon = cv2.resize(comp[100:200, 200:300], (48, 48))
+        cv2.imwrite(str(tmp_path / "icon.png"), icon)
+        blank = np.full((1280, 720, 3), 235, np.uint8)
+        cv2.putText(
+            blank, "static text", (40, 200),
+            cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 0), 3,
+        )
+        screen = blank.copy()
+        screen[600:648, 300:348] = icon
+        writer = cv2.VideoWriter(
+            str(tmp_path / "video.mp4"),
+            cv2.VideoWriter_fourcc(*"mp4v"),
+            30,
+            (720, 1280),
+        )
+        for i in range(20):
+            writer.write(screen if i >= 10 else blank)
+        writer.release()
+        received = []
+        ImageRecognition.add_telemetry_hook(received.append)
+        try:
+            found, score = testui_images.compare_video_image(
+                "video.mp4", "icon.png", 0.9, "", path=str(tmp_path)
+            )
+            assert found and score > 0.9
+            found, _, frame = testui_images.compare_video_image_parallel(
+                "video.mp4",
+                "icon.png",
+                0.9,
+                "",
+                path=str(tmp_path),
+                processes=2,
+            )
+        finally:
+            ImageRecognition.remove_telemetry_hook(received.append)
+        assert found
+        assert frame == 10
+        assert [stats["operation"] for stats in received] == [
+            "compare_video_image",
+            "compare_video_image_parallel",
+        ]
+        for stats in received:
+            assert stats["found"]
+            assert stats["image_size"] == (720, 1280)
+            assert stats["template_size"] == (48, 48)
+            assert stats["frames"] >= 2 and stats["scales"] > 0
+
+    def test_parallel_video_match_returns_earliest_frame(
+        self, images, tmp_path
+    ):
+        screen_path, _ = images
+        screen = cv2.imread(screen_path)
+        blank = screen.copy()
+        blank[690:860, 110:340] = 235
+        video_path = str(tmp_path / "video.mp4")
+        writer = cv2.VideoWriter(
+            video_path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (720, 1280)
+        )
+        for i in range(24):
+            frame = blank.copy() if i < 17 else screen.copy()
+            # every frame changes, so none of them is skipped
+            cv2.putText(
+                frame, str(i), (20, 40),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 3,
+            )
+            writer.write(frame)
+        writer.release()
+        found, score, frame = testui_images.compare_video_image_parallel(
+            "video.mp4",
+            "template.png",
+            0.9,
+            "",
+            path=str(tmp_path),
+            processes=2,
+            chunk_size=4,
+        )
+        assert found
+        assert score > 0.9
+        assert frame == 17
+
+    def test_region_limits_the_search(self, images):
+        screen_path, template_path = images
+        found, _ = testui_images.compare_images(
+            screen_path, template_path, 0.9, region=(0, 0, 720, 600)
+        )
+        assert not found
+        x, y = testui_images.get_point_match(
+            screen_path, template_path, region=(60, 650, 400, 300)
+        )
+        assert abs(x - (120 + 105)) <= 4
+        assert abs(y - (700 + 75)) <= 4
+
+    def test_scale_memo_is_kept_between_sessions(self, images, tmp_path):
+        screen_path, template_path = images
+        memo_path = str(tmp_path / "memo" / "scales.json")
+        testui_images.scale_memo.clear()
+        found, _ = ImageRecognition(
+            screen_path, template_path, 0.9, path="", device_udid="emulator"
+        ).compare()
+        assert found
+        key = testui_images.ScaleMemo.key(
+            template_path, "emulator", cv2.imread(screen_path)
+        )
+        scale = testui_images.scale_memo.get(key)
+        assert abs(scale - 1 / 1.5) < 0.05
+        ImageRecognition.save_scale_memo(memo_path)
+        testui_images.scale_memo.clear()
+        ImageRecognition.load_scale_memo(memo_path)
+        assert testui_images.scale_memo.get(key) == scale
+        x, y = testui_images.get_point_match(
+            screen_path, template_path, device="emulator"
+        )
+        assert abs(x - (120 + 105)) <= 4
+        assert abs(y - (700 + 75)) <= 4
+        testui_images.scale_memo.clear()
+
+    def test_batch_matches_share_one_screenshot(self, images, tmp_path):
+        screen_path, template_path = images
+        absent = np.zeros((80, 80, 3), np.uint8)
+        cv2.circle(absent, (40, 40), 30, (10, 200, 30), -1)
+        absent_path = str(tmp_path / "absent.png")
+        cv2.imwrite(absent_path, absent)
+        results = testui_images.compare_images_batch(
+            cv2.imread(screen_path), [template_path, absent_path], 0.9
+        )
+        assert results[template_path]["found"]
+        assert not results[absent_path]["found"]
+        x, y = results[template_path]["center"]
+        assert abs(x - (120 + 105)) <= 8
+        assert abs(y - (700 + 75)) <= 8
+
+    @pytest.mark.parametrize("profile", ["fast", "balanced", "exact"])
+    def test_match_profiles_find_the_template(self, images, profile):
+        screen_path, template_path = images
+        found, _ = ImageRecognition(
+            screen_path, template_path, 0.9, path="", profile=profile
+        ).compare()
+        assert found
+        x, y = testui_images.get_point_match(
+            screen_path, template_path, profile=profile
+        )
+        assert abs(x - (120 + 105)) <= 8
+        assert abs(y - (700 + 75)) <= 8
+
+    def test_unknown_match_profile(self, images):
+        screen_path, template_path = images
+        with pytest.raises(Exception):
+            testui_images.compare_images(
+                screen_path, template_path, profile="fastest"
+            )
+
+    def test_fft_correlation_matches_opencv(self, images):
+        screen_path, _ = images
+        screen = cv2.pyrDown(cv2.imread(screen_path))
+        template = screen[100:500, 50:300]
+        expected = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
+        result = testui_images.SpectrumCorrelator(screen).match(template)
+        assert result.shape == expected.shape
+        assert np.abs(result - expected).max() < 1e-3
+
+    def test_fft_engine_finds_large_template(self, images):
+        screen_path, _ = images
+        screen = cv2.imread(screen_path)
+        template = cv2.resize(screen[200:1100, 60:660], None, fx=0.8, fy=0.8)
+        assert testui_images.select_engine(
+            screen, template, cv2.TM_CCOEFF_NORMED
+        ) == "fft"
+        match = testui_images.pyramid_match(screen, template, 0.9)
+        assert match.score > 0.9
+        assert abs(match.x - 60) <= 4
+        assert abs(match.y - 200) <= 4
+
+    def test_coarse_template_keeps_its_details(self):
+        template = testui_images.TemplateEntry(np.zeros((90, 200, 3), np.uint8))
+        assert template.depth == 1
+        assert min(template.level(template.depth).shape[:2]) >= 40
+
+    def test_pyramid_finds_template_in_big_screen(self):
+        comp = cv2.imread(os.path.join(test_dir, "..", "resources", "comp.png"))
+        template = comp[100:200, 200:340]
+        screen = _screen(template, 1.0, 900, 2500, (1440, 3200))
+        match = testui_images.pyramid_match(screen, template, 0.9, 1.5, 0.5, 11)
+        assert match.score > 0.9
+        assert abs(match.x - 900) <= 4
+        assert abs(match.y - 2500) <= 4
+
+    def test_full_resolution_sweep_when_coarse_level_misses(self, images):
+        screen_path, template_path = images
+        screen = cv2.imread(screen_path)
+        template = cv2.imread(template_path)
+        # without refined candidates only the full resolution sweep is left
+        match = testui_images.pyramid_match(screen, template, 0.9, candidates=0)
+        assert match.score > 0.9
+        assert abs(match.x - 120) <= 4
+        assert abs(match.y - 700) <= 4
+
+    def test_feature_match_locates_template_in_one_pass(self):
+        comp = cv2.imread(os.path.join(test_dir, "..", "resources", "comp.png"))
+        template = comp[0:300, 0:400]
+        screen = _screen(template, 0.7, 60, 300)
+        match = testui_images.feature_match(
+            testui_images.ImagePyramid(screen),
+            testui_images.TemplateEntry(template),
+        )
+        assert match.score > 0.9
+        assert abs(match.scale - 1 / 0.7) < 0.05
+        assert abs(match.x - 60) <= 4
+        assert abs(match.y - 300) <= 4
+        x, y = testui_images.get_point_match(
+            screen, template, profile="features"
+        )
+        assert abs(x - (60 + 140)) <= 4
+        assert abs(y - (300 + 105)) <= 4
+
+    def test_unchanged_screen_reuses_the_result(self, images):
+        screen_path, template_path = images
+        screen = cv2.imread(screen_path)
+        testui_images.result_cache.clear()
+        first = testui_images.compare_images(
+            screen, template_path, 0.9, cache=True
+        )
+        again = testui_images.compare_images(
+            screen.copy(), template_path, 0.9, cache=True
+        )
+        assert again == first
+        assert ImageRecognition.result_cache_stats()["hits"] == 1
+        # a small icon swapped for another one, like play and pause
+        changed = screen.copy()
+        changed[10:30, 10:30] = 255 - changed[10:30, 10:30]
+        assert testui_images.screen_hash(changed) != testui_images.screen_hash(
+            screen
+        )
+        testui_images.compare_images(changed, template_path, 0.9, cache=True)
+        assert ImageRecognition.result_cache_stats()["hits"] == 1
+        changed[600:900, 100:400] = 235
+        found, _ = testui_images.compare_images(
+            changed, template_path, 0.9, cache=True
+        )
+        assert not found
+        testui_images.result_cache.clear()
+
+    def test_match_at_remembered_scale_is_cached(self, images):
+        screen_path, template_path = images
+        screen = cv2.imread(screen_path)
+        template = cv2.imread(template_path)
+        testui_images.result_cache.clear()
+        testui_images.scale_memo.remember("memo", 1 / 1.5)
+        match = testui_images.memo_match(
+            screen,
+            template,
+            0.9,
+            2.0,
+            0.3,
+            50,
+            None,
+            memo_key="memo",
+            result_key="result",
+        )
+        assert match.score > 0.9
+        cached = testui_images.result_cache.get("result")
+        assert (cached.score, cached.x, cached.y) == (
+            match.score,
+            match.x,
+            match.y,
+        )
+        testui_images.scale_memo.clear()
+        testui_images.result_cache.clear()
+
+    def test_telemetry_hooks_receive_match_stats(self, images):
+        screen_path, template_path = images
+        received = []
+
+        def failing_hook(_):
+            raise ValueError("hook error")
+
+        ImageRecognition.add_telemetry_hook(failing_hook)
+        ImageRecognition.add_telemetry_hook(received.append)
+        try:
+            found, score = testui_images.compare_images(
+                screen_path, template_path, 0.9
+            )
+        finally:
+            ImageRecognition.remove_telemetry_hook(failing_hook)
+            ImageRecognition.remove_telemetry_hook(received.append)
+        assert found
+        (stats,) = received
+        assert stats["operation"] == "compare_images"
+        assert stats["found"] and stats["score"] == score
+        assert stats["image_size"] == (720, 1280)
+        assert stats["template_size"] == (140, 100)
+        assert stats["scales"] > 0
+        # scale applied to the screen, where the template is 1.5 times larger
+        assert abs(stats["exit_scale"] - 1 / 1.5) < 0.1
+        assert "template" in stats["cache"]
+        assert stats["duration"] > 0
+
+    def test_size_is_read_from_the_png_header(self, images):
+        screen_path, _ = images
+        with open(screen_path, "rb") as file:
+            header = file.read(24)
+        assert testui_images.size_from_bytes(header) == (720, 1280)
+        assert testui_images.size(screen_path) == (720, 1280)
+        _, jpeg = cv2.imencode(".jpg", cv2.imread(screen_path))
+        assert testui_images.size_from_bytes(jpeg.tobytes()) == (720, 1280)
+
+    def test_thumbnail_from_bytes_is_reduced(self, images):
+        screen_path, _ = images
+        with open(screen_path, "rb") as file:
+            thumbnail = testui_images.thumbnail_from_bytes(file.read())
+        assert thumbnail.shape == (1280 // 4, 720 // 4)
+
+    def test_all_occurrences_in_reading_order(self, images):
+        _, template_path = images
+        template = cv2.imread(template_path)
+        screen = _screen(template, 1.0, 60, 100)
+        for (x, y) in ((400, 100), (60, 600), (400, 600)):
+            screen[y : y + 100, x : x + 140] = template
+        recognition = ImageRecognition(screen, template_path, 0.9, path="")
+        received = []
+        ImageRecognition.add_telemetry_hook(received.append)
+        try:
+            matches = recognition.get_matches()
+        finally:
+            ImageRecognition.remove_telemetry_hook(received.append)
+        (stats,) = received
+        assert stats["operation"] == "get_matches"
+        assert stats["found"] and stats["scales"] > 0
+        assert stats["template"] == template_path
+        expected = [(60, 100), (400, 100), (60, 600), (400, 600)]
+        assert len(matches) == len(expected)
+        for match, (x, y) in zip(matches, expected):
+            assert abs(match.x - x) <= 2
+            assert abs(match.y - y) <= 2
+        x, y = recognition.get_middle_point()
+        assert any(
+            abs(x - m.center[0]) <= 2 and abs(y - m.center[1]) <= 2
+            for m in matches
+        )
+
+    def test_workspace_reuses_buffers(self):
+        workspace = testui_images.Workspace()
+        rng = np.random.default_rng(1)
+        image = rng.integers(0, 255, (120, 90, 3), np.uint8)
+        first = workspace.resize("level", image, 60, 80)
+        second = workspace.resize("level", image, 45, 60)
+        assert np.shares_memory(first, second)
+        np.testing.assert_array_equal(
+            second,
+            cv2.resize(image, (45, 60), interpolation=cv2.INTER_AREA),
+        )
+        result = workspace.match(
+            image, image[10:30, 10:30], cv2.TM_CCOEFF_NORMED
+        )
+        assert result.shape == (101, 71)
+
+    def test_workspace_keeps_buffers_of_big_screens(self):
+        pool = testui_images.WorkspacePool()
+        shape = (2160 - 99, 3840 - 99)
+        workspace = pool.current()
+        first = workspace.array("result", shape, np.float32)
+        assert not np.shares_memory(
+            first, workspace.array("result", shape, np.float32)
+        )
+        pool.fit(np.empty((2160, 3840, 3), np.uint8))
+        workspace = pool.current()
+        first = workspace.array("result", shape, np.float32)
+        assert np.shares_memory(
+            first, workspace.array("result", shape, np.float32)
+        )
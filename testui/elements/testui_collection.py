@@ -3,6 +3,7 @@ import time
 
 from testui.elements.testui_element import Elements
 from testui.support import logger
+from testui.support.attribute_reader import AttributeReader, MISSING
 from testui.support.configuration import Configuration
 from testui.support.helpers import error_with_traceback
 
@@ -31,6 +32,7 @@ class Collections:
         """
         self.args = args
         self.__errors = []
+        self.__last = []
 
     def wait_until_all_visible(self, seconds=10.0, log=True):
         """
@@ -67,36 +69,41 @@ class Collections:
 
     def wait_until_all_exist(self, seconds=10.0, log=True):
         """
-        Wait until all elements in collection are visible
+        Wait until all elements in collection exist, or don't for the ones
+        set with no(). All of them are looked up with one request per poll,
+        see AttributeReader
         :param seconds: timeout
         :param log: log to console
         """
         start = time.time()
-        threads = []
-        for arg in self.args:
-            threads.append(
-                threading.Thread(
-                    target=arg.wait_until_exists, args=(seconds, log)
+        is_not = [element.take_is_not() for element in self.args]
+        values = self.__poll(
+            [None] * len(self.args),
+            seconds,
+            lambda values: all(
+                (value is MISSING) == negated
+                for value, negated in zip(values, is_not)
+            ),
+        )
+        if values is not None:
+            if log:
+                logger.log(
+                    f"{self.args[0].device_name}: Collection of elements has "
+                    f"been found after {time.time() - start}s"
                 )
-            )
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
-        if time.time() < start + seconds:
-            logger.log(
-                f"{self.args[0].device_name}: Collection of elements has been "
-                f"found after {time.time() - start}s"
-            )
-        else:
-            compose_error = ""
-            error: str
-            for error in self.__errors:
-                compose_error = compose_error + f"{error} \n"
-            self.__show_error(
-                f"{self.args[0].device_name}: Collection of elements has not "
-                f"been found after {time.time() - start}s: \n {compose_error}"
-            )
+            return
+        compose_error = ""
+        for element, value, negated in zip(self.args, self.__last, is_not):
+            if (value is MISSING) != negated:
+                err_text = "found" if negated else "not found"
+                compose_error += (
+                    f'"{element.locator_type}: {element.locator}" '
+                    f"{err_text} \n"
+                )
+        self.__show_error(
+            f"{self.args[0].device_name}: Collection of elements has not "
+            f"been found after {time.time() - start}s: \n {compose_error}"
+        )
 
     def find_visible(self, seconds=10, return_el_number=False):
         """
@@ -128,7 +135,9 @@ class Collections:
 
     def wait_until_attribute(self, attr_type: list, attr: list, seconds=10):
         """
-        Wait until all elements in collection have the correct attribute
+        Wait until all elements in collection have the correct attribute, or
+        a different one for the ones set with no(). The attributes of all the
+        elements are read with one request per poll, see AttributeReader
         :param attr_type: list of attribute types
         :param attr: list of attributes
         :param seconds: timeout
@@ -139,37 +148,41 @@ class Collections:
                 "The number of attributes checked must be the same as number "
                 "of elements in collection"
             )
-        threads = []
-        i = 0
-        element: Elements
-        for element in self.args:
-            threads.append(
-                threading.Thread(
-                    target=self.__wait_until_attribute,
-                    args=(element, attr_type[i], attr[i], seconds),
-                )
-            )
-            i += 1
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
-        if time.time() < start + seconds:
+        is_not = [element.take_is_not() for element in self.args]
+        values = self.__poll(
+            list(attr_type),
+            seconds,
+            lambda values: all(
+                value is not MISSING and (value == text) != negated
+                for value, text, negated in zip(values, attr, is_not)
+            ),
+        )
+        if values is not None:
             logger.log(
                 f"{self.args[0].device_name}: Collection of elements has been "
                 "found with the correct attributes "
                 f"after {time.time() - start}s"
             )
-        else:
-            compose_error = ""
-            error: str
-            for error in self.__errors:
-                compose_error = compose_error + f"{error} \n"
-            self.__show_error(
-                f"{self.args[0].device_name}: Collection of elements has not "
-                "been found with the correct attributes "
-                f"after {time.time() - start}s: \n {compose_error}"
+            return
+        compose_error = ""
+        element: Elements
+        for element, name, value, text, negated in zip(
+            self.args, attr_type, self.__last, attr, is_not
+        ):
+            if value is MISSING:
+                value = "not found"
+            elif (value == text) != negated:
+                continue
+            err_text = "should not have been" if negated else "should have been"
+            compose_error += (
+                f'"{element.locator_type}: {element.locator}" attribute '
+                f'"{name}" -> "{value}" {err_text} "{text}" \n'
             )
+        self.__show_error(
+            f"{self.args[0].device_name}: Collection of elements has not "
+            "been found with the correct attributes "
+            f"after {time.time() - start}s: \n {compose_error}"
+        )
 
     def get(self, index: int):
         """
@@ -180,20 +193,28 @@ class Collections:
         element: Elements = self.args[index]
         return element
 
-    def __wait_until_attribute(
-        self, element: Elements, attr_type, attr, seconds
-    ):
+    def __poll(self, attributes: list, seconds, condition):
         """
-        Wait until element has the correct attribute
-        :param element: element
-        :param attr_type: attribute type
-        :param attr: attribute
+        Reads the attributes of all the elements until the condition is met
+        :param attributes: attribute of each element, None to only check
+        that it exists
         :param seconds: timeout
+        :param condition: function receiving the list of values, where
+        elements that are not found are MISSING
+        :return: list of values, None if the condition was not met in time.
+        The last values read are kept in self.__last
         """
-        try:
-            element.wait_until_attribute(attr_type, attr, seconds)
-        except Exception as err:
-            self.__errors.append(err)
+        start = time.time()
+        reader = AttributeReader(self.args[0].testui_driver)
+        refresh = False
+        while True:
+            self.__last = reader.read(self.args, attributes, refresh)
+            refresh = True
+            if condition(self.__last):
+                return self.__last
+            if time.time() >= start + seconds:
+                return None
+            time.sleep(0.2)
 
     def __show_error(self, exception) -> None:
         """
@@ -204,7 +225,7 @@ class Collections:
         config: Configuration = driver.configuration
 
         if config.save_screenshot_on_fail:
-            driver.save_screenshot()
+            driver.save_failure_artifacts()
 
         full_exception = exception
         if config.save_full_stacktrace:
@@ -1,9 +1,9 @@
 from __future__ import annotations
 
 import time
-import os
 
 from typing import List
+import cv2
 from appium.webdriver.webelement import WebElement
 from selenium.webdriver import ActionChains
 from selenium.webdriver.common.by import By
@@ -11,7 +11,12 @@ from appium.webdriver.common.appiumby import AppiumBy
 
 from testui.support import logger
 from testui.support.helpers import error_with_traceback
-from testui.support.testui_images import Dimensions, ImageRecognition
+from testui.support.testui_images import (
+    crop_region,
+    Dimensions,
+    image_from_bytes,
+    ImageRecognition,
+)
 
 
 def testui_error(driver, exception: str) -> None:
@@ -25,7 +30,7 @@ def testui_error(driver, exception: str) -> None:
 
     if config.save_screenshot_on_fail:
         try:
-            driver.save_screenshot()
+            driver.save_failure_artifacts()
         except Exception as error:
             exception += (
                 f"{logger.bcolors.FAIL} \n"
@@ -558,6 +563,17 @@ class Elements:
         self.__is_not = is_not
         return self
 
+    def take_is_not(self) -> bool:
+        """
+        Whether no() was set for the next check, which is reset like the
+        checks of the element do. Used by Collections, which check all the
+        elements together.
+        :return: Boolean
+        """
+        is_not = self.__is_not
+        self.__is_not = False
+        return is_not
+
     def click(self):
         """Click on element"""
         timeout = 5  # [seconds]
@@ -568,6 +584,7 @@ class Elements:
             try:
                 element = self.get_element()
                 element.click()
+                self.testui_driver.invalidate_snapshots()
                 self.__put_log(
                     f'{self.device_name}: element "{self.locator_type}: '
                     f'{self.locator}" pressed for {time.time() - start}s'
@@ -666,27 +683,46 @@ class Elements:
         try:
             self.get_element().screenshot(image_name)
         except Exception:
-            path_img = self.testui_driver.save_screenshot(
-                f"{self.device_name}-crop_image.png"
-            )
-            dimensions = self.dimensions
-            top_left = self.location
-            logger.log_debug(
-                "crop dimensions (x,y,w,h):"
-                f"({top_left.x},{top_left.y},{dimensions.x},{dimensions.y})"
-            )
-            ImageRecognition(path_img).crop_original_image(
-                (top_left.x + dimensions.x // 2),
-                (top_left.y + dimensions.y // 2),
-                dimensions.x,
-                dimensions.y,
-                image_name,
-            )
-
-            os.remove(path_img)
+            cv2.imwrite(image_name, self.__cropped_screenshot())
 
         return self
 
+    def screenshot_as_image(self):
+        """
+        Takes screenshot of the specific element and decodes it in memory,
+        without saving it to disk. When screenshot_cache_ttl is set, or the
+        driver can't take screenshots of elements, the element is cropped
+        from a screenshot of the screen, so the cached one is reused.
+        :return: numpy array with the screenshot in BGR format
+        """
+        self.wait_until_visible()
+        if self.testui_driver.configuration.screenshot_cache_ttl:
+            return self.__cropped_screenshot()
+        try:
+            image = image_from_bytes(self.get_element().screenshot_as_png)
+        except Exception:
+            return self.__cropped_screenshot()
+        if image is None:
+            return self.__cropped_screenshot()
+        return image
+
+    def __cropped_screenshot(self):
+        """
+        Crops the element from an in-memory screenshot of the screen
+        :return: numpy array in BGR format
+        """
+        screen = self.testui_driver.get_screenshot_as_image()
+        dimensions = self.dimensions
+        top_left = self.location
+        logger.log_debug(
+            "crop dimensions (x,y,w,h):"
+            f"({top_left.x},{top_left.y},{dimensions.x},{dimensions.y})"
+        )
+        cropped, _ = crop_region(
+            screen, (top_left.x, top_left.y, dimensions.x, dimensions.y)
+        )
+        return cropped.copy()
+
     def find_image_match(
         self,
         image_name,
@@ -694,6 +730,7 @@ class Elements:
         image_match="",
         max_scale=2.0,
         min_scale=0.3,
+        region=None,
     ):
         """
         Takes screenshot of the element and compares it with the one you provide
@@ -703,13 +740,22 @@ class Elements:
         :param image_match: returns the image with a rectangle showing the match
         :param image_name: relative path to image
         :param threshold: limit to consider image as a match (0 to 1)
+        :param region: only search within this part of the element, given as
+        a (x, y, width, height) rectangle relative to the element or as an
+        element inside it
         :return: Elements
         """
         is_not = self.__is_not
         self.__is_not = False
-        self.screenshot(self.device_name + ".png")
         found, precision = ImageRecognition(
-            self.device_name + ".png", image_name, threshold, self.device_name
+            self.screenshot_as_image(),
+            image_name,
+            threshold,
+            self.device_name,
+            region=self.__relative_region(region),
+            device_udid=self.testui_driver.device_udid or self.device_name,
+            profile=self.testui_driver.configuration.match_profile,
+            cache=self.testui_driver.configuration.cache_image_results,
         ).compare(
             image_match=image_match, max_scale=max_scale, min_scale=min_scale
         )
@@ -724,9 +770,6 @@ class Elements:
                 f"{self.device_name}: The images compared matched. "
                 f"Threshold={threshold}, matched = {precision}"
             )
-        root_dir = self.testui_driver.configuration.screenshot_path
-        os.remove(os.path.join(root_dir, self.device_name + ".png"))
-
         return self
 
     def is_image_match(
@@ -736,6 +779,7 @@ class Elements:
         image_match="",
         max_scale=2.0,
         min_scale=0.3,
+        region=None,
     ):
         """
         Takes screenshot of the element and compares it with the one you provide
@@ -745,13 +789,22 @@ class Elements:
         :param image_match: returns the image with a rectangle showing the match
         :param image_name: relative path to image
         :param threshold: limit to consider image as a match (0 to 1)
+        :param region: only search within this part of the element, given as
+        a (x, y, width, height) rectangle relative to the element or as an
+        element inside it
         :return: Elements
         """
         is_not = self.__is_not
         self.__is_not = False
-        self.screenshot(self.device_name + ".png")
         found, _ = ImageRecognition(
-            self.device_name + ".png", image_name, threshold, self.device_name
+            self.screenshot_as_image(),
+            image_name,
+            threshold,
+            self.device_name,
+            region=self.__relative_region(region),
+            device_udid=self.testui_driver.device_udid or self.device_name,
+            profile=self.testui_driver.configuration.match_profile,
+            cache=self.testui_driver.configuration.cache_image_results,
         ).compare(
             image_match=image_match, max_scale=max_scale, min_scale=min_scale
         )
@@ -759,11 +812,27 @@ class Elements:
             return False
         if found and is_not:
             return False
-        root_dir = self.testui_driver.configuration.screenshot_path
-        os.remove(os.path.join(root_dir, self.device_name + ".png"))
 
         return True
 
+    def __relative_region(self, region):
+        """
+        Converts an element used as region of interest to a rectangle
+        relative to this element, as element screenshots start at its corner
+        :param region: rectangle, element or None
+        :return: rectangle or None
+        """
+        if not isinstance(region, Elements):
+            return region
+        location, dimensions = region.location, region.dimensions
+        top_left = self.location
+        return (
+            location.x - top_left.x,
+            location.y - top_left.y,
+            dimensions.x,
+            dimensions.y,
+        )
+
     def swipe(
         self,
         start_x=None,
@@ -904,6 +973,7 @@ class Elements:
         while time.time() < start + timeout:
             try:
                 self.get_element().send_keys(value)
+                self.testui_driver.invalidate_snapshots()
                 if log:
                     self.__put_log(
                         f'{self.device_name}: element "{self.locator_type}: '
@@ -925,6 +995,7 @@ class Elements:
         Clear the text of the element identified by the specified locator.
         """
         self.get_element().clear()
+        self.testui_driver.invalidate_snapshots()
 
         return self
 
@@ -1049,6 +1120,7 @@ class Elements:
         threshold=0.9,
         fps_reduction=1,
         keep_image_as="",
+        processes=0,
     ):
         """
         Press and compare image
@@ -1057,6 +1129,8 @@ class Elements:
         :param threshold: threshold
         :param fps_reduction: fps_reduction
         :param keep_image_as: keep_image_as
+        :param processes: size of the process pool comparing the video frames,
+        0 to compare them in this process
         """
         self.testui_driver.start_recording_screen()
         self.press_hold_for(milliseconds)
@@ -1070,7 +1144,13 @@ class Elements:
         start = time.time()
 
         if self.testui_driver.stop_recording_and_compare(
-            image, threshold, fps_reduction, self.__is_not, keep_image_as, False
+            image,
+            threshold,
+            fps_reduction,
+            self.__is_not,
+            keep_image_as,
+            False,
+            processes,
         ):
             self.__put_log(
                 f"{self.device_name}: image {found} found while pressing "
@@ -1112,21 +1192,24 @@ class Elements:
         start = time.time()
         self.wait_until_visible()
         self.__is_collection = True
+        local = self.testui_driver.configuration.page_source_snapshot
+        refresh = False
         while time.time() < start + timeout:
-            for i, element in enumerate(self.__find_by_collection()):
-                if case_sensitive and element.get_attribute(attribute) == value:
-                    self.__put_log(
-                        f"{self.device_name}: element in collection "
-                        f'{self.locator_type}: {self.locator}" with attribute '
-                        f'"{attribute}" = "{value}" found after '
-                        f"{time.time() - start}s"
-                    )
-                    self.index = i
-                    return self
-                if (
+            values = None
+            if local:
+                values = self.__snapshot_attributes(attribute, refresh)
+                local = values is not None
+                refresh = True
+            if values is None:
+                values = (
+                    element.get_attribute(attribute)
+                    for element in self.__find_by_collection()
+                )
+            for i, current in enumerate(values):
+                if current == value or (
                     not case_sensitive
-                    and element.get_attribute(attribute).lower()
-                    == value.lower()
+                    and current is not None
+                    and current.lower() == value.lower()
                 ):
                     self.__put_log(
                         f"{self.device_name}: element in collection "
@@ -1142,6 +1225,36 @@ class Elements:
             f'"{attribute}" = "{value}" after {time.time() - start}s'
         )
 
+    def __snapshot_attributes(self, attribute, refresh=False):
+        """
+        Reads an attribute of all the elements of the locator from the page
+        source snapshot of the driver, with one request instead of one per
+        element
+        :param attribute: attribute
+        :param refresh: fetch a new page source
+        :return: list of values, None if the locator can't be evaluated on
+        the page source
+        """
+        snapshot = self.testui_driver.get_page_source_snapshot(refresh)
+        if snapshot is None:
+            return None
+        nodes = snapshot.find(self.locator_type, self.locator)
+        if nodes is None:
+            return None
+        values = []
+        found = None
+        for i, node in enumerate(nodes):
+            if snapshot.has_attribute(node, attribute):
+                values.append(snapshot.attribute(node, attribute))
+                continue
+            # e.g. "name" in Android, read by get_attribute from the element
+            if found is None:
+                found = self.__find_by_collection()
+            values.append(
+                found[i].get_attribute(attribute) if i < len(found) else None
+            )
+        return values
+
 
 def e(driver, locator_type: str, locator: str) -> Elements:
     """
@@ -286,6 +286,38 @@ class NewDriver:
         self.__configuration.save_full_stacktrace = save_full_stacktrace
         return self
 
+    def set_save_page_source_on_fail(self, save_page_source_on_fail: bool):
+        """Set save page source on fail"""
+        self.__configuration.save_page_source_on_fail = (
+            save_page_source_on_fail
+        )
+        return self
+
+    def set_scale_memo_path(self, scale_memo_path: str):
+        """Set file where the scales of the image matches are kept"""
+        self.__configuration.scale_memo_path = scale_memo_path
+        return self
+
+    def set_match_profile(self, match_profile: str):
+        """Set image recognition profile, see Configuration.match_profile"""
+        self.__configuration.match_profile = match_profile
+        return self
+
+    def set_cache_image_results(self, cache_image_results: bool):
+        """Set reuse of image recognition results in unchanged screens"""
+        self.__configuration.cache_image_results = cache_image_results
+        return self
+
+    def set_screenshot_cache_ttl(self, seconds: float):
+        """Set seconds a screenshot is shared by consecutive visual checks"""
+        self.__configuration.screenshot_cache_ttl = seconds
+        return self
+
+    def set_page_source_snapshot(self, page_source_snapshot: bool):
+        """Set local evaluation of collections on one page source"""
+        self.__configuration.page_source_snapshot = page_source_snapshot
+        return self
+
     def set_platform(self, platform):
         """
         Set platform
@@ -0,0 +1,87 @@
+import atexit
+import queue
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from testui.support import logger
+
+
+class ArtifactWriter:
+    """
+    Writes failure artifacts (screenshots, page sources) to disk from a
+    background thread, so the test thread only pays for capturing them. The
+    queue is bounded: when the disk can't keep up, new artifacts wait for a
+    free slot instead of piling up in memory.
+    """
+
+    def __init__(self, max_size=32):
+        self.__queue = queue.Queue(max_size)
+        self.__lock = threading.Lock()
+        self.__thread = None
+
+    def write(self, path: str, data):
+        """
+        Queues an artifact to be written
+        :param path: file where it is written, parent directories are created
+        :param data: bytes, str or numpy array, which is encoded as PNG by
+        the worker
+        """
+        self.__start()
+        self.__queue.put((path, data))
+
+    def flush(self):
+        """
+        Waits until all the queued artifacts are written
+        """
+        if self.__thread is not None:
+            self.__queue.join()
+
+    def __start(self):
+        """
+        Starts the worker thread the first time something is written
+        """
+        with self.__lock:
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__thread = threading.Thread(
+                    target=self.__work, name="testui-artifacts", daemon=True
+                )
+                self.__thread.start()
+
+    def __work(self):
+        """
+        Worker writing the queued artifacts, until the process exits
+        """
+        while True:
+            path, data = self.__queue.get()
+            try:
+                ArtifactWriter.__save(path, data)
+                logger.log_debug(f'Artifact saved in "{path}"')
+            except Exception as error:  # pylint: disable=broad-except
+                logger.log_error(f"Could not save {path}: {error}")
+            finally:
+                self.__queue.task_done()
+
+    @staticmethod
+    def __save(path: str, data):
+        """
+        Writes one artifact
+        :param path: file where it is written
+        :param data: bytes, str or numpy array
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(data, np.ndarray):
+            ok, encoded = cv2.imencode(".png", data)
+            if not ok:
+                raise Exception("the image could not be encoded as PNG")
+            data = encoded.tobytes()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with open(path, "wb") as file:
+            file.write(data)
+
+
+artifact_writer = ArtifactWriter()
+atexit.register(artifact_writer.flush)
@@ -0,0 +1,196 @@
+from testui.support import logger
+from testui.support.page_source import PageSource
+
+# value read for an element that was not found
+MISSING = object()
+# value of the locators that must be read element by element
+_UNSUPPORTED = object()
+
+
+class AttributeReader:
+    """
+    Reads attributes of several Elements with one request: one
+    execute_script in browsers and web views, and one page source in native
+    apps when configuration.page_source_snapshot is set. Locators that can't
+    be evaluated that way (uiautomator, classChain...) and attributes
+    missing in the page source fall back to a get_attribute request per
+    element.
+    """
+
+    # evaluates [locator type, locator, index, attribute] requests in the
+    # browser, like find_elements and get_attribute
+    SCRIPT = """
+        function find(type, locator) {
+            switch (type) {
+                case "id":
+                    return document.querySelectorAll("#" + CSS.escape(locator));
+                case "css":
+                    return document.querySelectorAll(locator);
+                case "className":
+                    return document.getElementsByClassName(locator);
+                case "name":
+                    return document.getElementsByName(locator);
+                case "xpath":
+                    var found = document.evaluate(
+                        locator, document, null,
+                        XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+                    );
+                    var nodes = [];
+                    for (var i = 0; i < found.snapshotLength; i++) {
+                        nodes.push(found.snapshotItem(i));
+                    }
+                    return nodes;
+            }
+            return null;
+        }
+        function read(element, name) {
+            if (name === null) return null;
+            if (name === "class") return element.getAttribute("class");
+            var value = element[name];
+            if (value === undefined || value === null ||
+                typeof value === "object" || typeof value === "function") {
+                return element.getAttribute(name);
+            }
+            if (typeof value === "boolean") return value ? "true" : null;
+            return String(value);
+        }
+        return arguments[0].map(function (request) {
+            var elements;
+            try {
+                elements = find(request[0], request[1]);
+            } catch (error) {
+                return {missing: true};
+            }
+            if (elements === null) return {unsupported: true};
+            var element = elements[request[2]];
+            if (!element) return {missing: true};
+            return {value: read(element, request[3])};
+        });
+    """
+
+    def __init__(self, testui_driver):
+        self.__testui_driver = testui_driver
+        self.__web = None
+
+    def read(self, elements: list, attributes: list, refresh=False) -> list:
+        """
+        Reads one attribute of each element
+        :param elements: list of Elements
+        :param attributes: attribute of each element, None to only check
+        that the element exists
+        :param refresh: with page source snapshots, fetch a new page source
+        even if no action was done since the last one, e.g. when polling
+        :return: list with the value of each attribute, None when the element
+        doesn't have it and MISSING when the element is not found
+        """
+        if self.__is_web():
+            values = self.__read_script(elements, attributes)
+        elif self.__testui_driver.configuration.page_source_snapshot:
+            values = self.__read_page_source(elements, attributes, refresh)
+        else:
+            values = [_UNSUPPORTED] * len(elements)
+        return [
+            (
+                AttributeReader.__read_element(element, attribute)
+                if value is _UNSUPPORTED
+                else value
+            )
+            for element, attribute, value in zip(elements, attributes, values)
+        ]
+
+    def __is_web(self) -> bool:
+        """
+        Whether the elements are in a browser or web view, checked once
+        :return: bool
+        """
+        if self.__web is None:
+            self.__web = bool(self.__testui_driver.browser)
+            if not self.__web:
+                try:
+                    context = self.__testui_driver.driver.current_context
+                    self.__web = "WEBVIEW" in str(context) or (
+                        "CHROMIUM" in str(context)
+                    )
+                except Exception:  # pylint: disable=broad-except
+                    self.__web = False
+        return self.__web
+
+    def __read_script(self, elements, attributes) -> list:
+        """
+        Reads the attributes with one execute_script
+        :return: list of values, _UNSUPPORTED for unsupported locators
+        """
+        requests = [
+            [element.locator_type, element.locator, element.index, attribute]
+            for element, attribute in zip(elements, attributes)
+        ]
+        # the raw driver is used, as the script is not an action that
+        # invalidates the snapshots of TestUIDriver
+        try:
+            results = self.__testui_driver.driver.execute_script(
+                self.SCRIPT, requests
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            logger.log_debug(f"Attributes could not be read together: {error}")
+            return [_UNSUPPORTED] * len(requests)
+        values = []
+        for result in results:
+            if result.get("unsupported"):
+                values.append(_UNSUPPORTED)
+            elif result.get("missing"):
+                values.append(MISSING)
+            else:
+                values.append(result.get("value"))
+        return values
+
+    def __read_page_source(self, elements, attributes, refresh) -> list:
+        """
+        Reads the attributes from one page source
+        :return: list of values, _UNSUPPORTED for unsupported locators and
+        attributes that are not in the page source
+        """
+        try:
+            snapshot = self.__testui_driver.get_page_source_snapshot(refresh)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.log_debug(f"Page source could not be read: {error}")
+            snapshot = None
+        values = []
+        for element, attribute in zip(elements, attributes):
+            nodes = None
+            if snapshot is not None:
+                nodes = snapshot.find(element.locator_type, element.locator)
+            if nodes is None:
+                values.append(_UNSUPPORTED)
+            elif element.index >= len(nodes):
+                values.append(MISSING)
+            elif attribute is None:
+                values.append(None)
+            elif not PageSource.has_attribute(nodes[element.index], attribute):
+                # e.g. "name" in Android, read by get_attribute from the
+                # element itself
+                values.append(_UNSUPPORTED)
+            else:
+                values.append(
+                    PageSource.attribute(nodes[element.index], attribute)
+                )
+        return values
+
+    @staticmethod
+    def __read_element(element, attribute):
+        """
+        Reads the attribute of one element with its own requests
+        :param element: Elements
+        :param attribute: attribute, None to only check that it exists
+        :return: value, None or MISSING
+        """
+        try:
+            found = element.get_element()
+            if attribute is None:
+                return None
+            return found.get_attribute(attribute)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.log_debug(
+                f'"{element.locator_type}: {element.locator}" not read: '
+                f"{error}"
+            )
+            return MISSING
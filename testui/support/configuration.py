@@ -6,6 +6,12 @@ class Configuration:
     __screenshot_path: str = ""
     __save_screenshot_on_fail: bool = True
     __save_full_stacktrace: bool = True
+    __save_page_source_on_fail: bool = False
+    __scale_memo_path: str = ""
+    __match_profile: str = "exact"
+    __cache_image_results: bool = False
+    __screenshot_cache_ttl: float = 0
+    __page_source_snapshot: bool = False
 
     @property
     def screenshot_path(self) -> str:
@@ -54,3 +60,107 @@ class Configuration:
         :param value: Boolean
         """
         self.__save_full_stacktrace = value
+
+    @property
+    def save_page_source_on_fail(self) -> bool:
+        """
+        Save page source next to the screenshot on fail
+        :return: Boolean
+        """
+        return self.__save_page_source_on_fail
+
+    @save_page_source_on_fail.setter
+    def save_page_source_on_fail(self, value: bool) -> None:
+        """
+        Save page source next to the screenshot on fail
+        :param value: Boolean
+        """
+        self.__save_page_source_on_fail = value
+
+    @property
+    def scale_memo_path(self) -> str:
+        """
+        JSON file where the scales of the image matches are kept between
+        sessions. Empty to not keep them
+        :return: String
+        """
+        return self.__scale_memo_path
+
+    @scale_memo_path.setter
+    def scale_memo_path(self, path: str) -> None:
+        """
+        JSON file where the scales of the image matches are kept between
+        sessions. Empty to not keep them
+        :param path: String
+        """
+        self.__scale_memo_path = path
+
+    @property
+    def match_profile(self) -> str:
+        """
+        Quality profile of the image recognition: "fast", "balanced",
+        "exact" or "features"
+        :return: String
+        """
+        return self.__match_profile
+
+    @match_profile.setter
+    def match_profile(self, profile: str) -> None:
+        """
+        Quality profile of the image recognition: "fast", "balanced",
+        "exact" or "features"
+        :param profile: String
+        """
+        self.__match_profile = profile
+
+    @property
+    def cache_image_results(self) -> bool:
+        """
+        Reuse image recognition results while the screen doesn't change
+        :return: Boolean
+        """
+        return self.__cache_image_results
+
+    @cache_image_results.setter
+    def cache_image_results(self, value: bool) -> None:
+        """
+        Reuse image recognition results while the screen doesn't change
+        :param value: Boolean
+        """
+        self.__cache_image_results = value
+
+    @property
+    def screenshot_cache_ttl(self) -> float:
+        """
+        Seconds a screenshot is reused by the visual checks while no action
+        is done. 0 to always take a new one
+        :return: Float
+        """
+        return self.__screenshot_cache_ttl
+
+    @screenshot_cache_ttl.setter
+    def screenshot_cache_ttl(self, seconds: float) -> None:
+        """
+        Seconds a screenshot is reused by the visual checks while no action
+        is done. 0 to always take a new one
+        :param seconds: Float
+        """
+        self.__screenshot_cache_ttl = seconds
+
+    @property
+    def page_source_snapshot(self) -> bool:
+        """
+        Evaluate locators and attributes of native collections on one page
+        source until the next action
+        :return: Boolean
+        """
+        return self.__page_source_snapshot
+
+    @page_source_snapshot.setter
+    def page_source_snapshot(self, value: bool) -> None:
+        """
+        Evaluate locators and attributes of native collections on one page
+        source until the next action
+        :param value: Boolean
+        """
+        self.__page_source_snapshot = value
@@ -0,0 +1,141 @@
+from lxml import etree
+
+from testui.support import logger
+
+
+class PageSource:
+    """
+    Snapshot of the native page source (driver.page_source) parsed with lxml,
+    to evaluate locators and read attributes of many elements locally with a
+    single request to Appium. Elements are returned in document order, the
+    same order as driver.find_elements.
+    """
+
+    # names accepted by get_attribute for attributes of the page source
+    ALIASES = {
+        "contentDescription": "content-desc",
+        "resourceId": "resource-id",
+        "className": "class",
+    }
+
+    # XPath of the locators that can be evaluated on the page source, by
+    # platform. $value is the locator, see PageSource.value.
+    LOCATORS = {
+        "android": {
+            "id": "//*[@resource-id=$value]",
+            "accessibility": "//*[@content-desc=$value]",
+            "className": "//*[@class=$value]",
+        },
+        "ios": {
+            "id": "//*[@name=$value]",
+            "accessibility": "//*[@name=$value]",
+            "className": "//*[local-name()=$value]",
+        },
+    }
+
+    def __init__(self, root):
+        self.root = root
+        self.platform = "android"
+        if root.tag == "AppiumAUT" or root.tag.startswith("XCUIElementType"):
+            self.platform = "ios"
+        self.package = None
+        if self.platform == "android":
+            self.package = root.xpath("string((//*[@package])[1]/@package)")
+        self.__found = {}
+
+    @classmethod
+    def parse(cls, source: str):
+        """
+        Parses a page source
+        :param source: XML returned by driver.page_source
+        :return: PageSource, None if it is not a native page source, e.g.
+        the HTML of a web view
+        """
+        try:
+            root = etree.fromstring(
+                source.encode("utf-8"), etree.XMLParser(huge_tree=True)
+            )
+        except etree.XMLSyntaxError as error:
+            logger.log_debug(f"Page source is not native XML: {error}")
+            return None
+        if root.tag.lower() == "html":
+            return None
+        return cls(root)
+
+    def xpath(self, expression: str, **variables) -> list:
+        """
+        Evaluates an XPath expression on the snapshot
+        :param expression: XPath, may use $variables
+        :param variables: values of the $variables
+        :return: list of lxml elements
+        """
+        return self.root.xpath(expression, **variables)
+
+    def find(self, locator_type: str, locator: str):
+        """
+        Elements matching a locator, see Elements. Results are kept, so each
+        locator is only evaluated once per snapshot.
+        :param locator_type: id, accessibility, className or xpath
+        :param locator: locator
+        :return: list of lxml elements, None if the locator type can't be
+        evaluated on the page source, or the XPath is not supported by lxml
+        """
+        key = (locator_type, locator)
+        if key not in self.__found:
+            try:
+                if locator_type == "xpath":
+                    found = self.xpath(locator)
+                elif locator_type in self.LOCATORS[self.platform]:
+                    found = self.xpath(
+                        self.LOCATORS[self.platform][locator_type],
+                        value=self.value(locator_type, locator),
+                    )
+                else:
+                    return None
+            except etree.XPathError as error:
+                # e.g. XPath 2.0 functions, which Appium may support
+                logger.log_debug(f"{locator} not evaluated locally: {error}")
+                return None
+            self.__found[key] = [
+                node for node in found if etree.iselement(node)
+            ]
+        return self.__found[key]
+
+    def value(self, locator_type: str, locator: str) -> str:
+        """
+        Value searched for a locator. Like Appium, Android ids without a
+        package (e.g. "title") are ids of the app, "<package>:id/title",
+        where the package is the one of the first node of the page source.
+        :param locator_type: locator type
+        :param locator: locator
+        :return: str
+        """
+        if (
+            self.platform == "android"
+            and locator_type == "id"
+            and ":id/" not in locator
+            and self.package
+        ):
+            return f"{self.package}:id/{locator}"
+        return locator
+
+    @classmethod
+    def has_attribute(cls, node, attribute: str) -> bool:
+        """
+        Whether the page source has the attribute of an element, as
+        get_attribute accepts attributes that are not in the page source
+        :param node: lxml element
+        :param attribute: attribute name
+        :return: bool
+        """
+        return cls.ALIASES.get(attribute, attribute) in node.attrib
+
+    @classmethod
+    def attribute(cls, node, attribute: str):
+        """
+        Value of an attribute of an element, like get_attribute
+        :param node: lxml element
+        :param attribute: attribute name
+        :return: str, None if the element doesn't have it
+        """
+        return node.get(cls.ALIASES.get(attribute, attribute))
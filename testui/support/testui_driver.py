@@ -1,5 +1,6 @@
 import base64
 import os
+import time
 import warnings
 
 from datetime import datetime
@@ -12,8 +13,19 @@ from selenium.common.exceptions import WebDriverException
 
 from testui.elements.testui_element import e
 from testui.support import logger
+from testui.support.artifact_writer import artifact_writer
+from testui.support.page_source import PageSource
 from testui.support.helpers import error_with_traceback
-from testui.support.testui_images import get_point_match, ImageRecognition
+from testui.support.testui_images import (
+    compare_images_batch,
+    Dimensions,
+    frame_difference,
+    get_match,
+    image_from_bytes,
+    ImageRecognition,
+    size_from_bytes,
+    thumbnail_from_bytes,
+)
 from testui.support.configuration import Configuration
 
 
@@ -53,6 +65,14 @@ class TestUIDriver:
         self.device_name = driver.device_name
         self.file_name = driver.file_name
         self.__configuration: Configuration = driver.configuration
+        self.__screenshot = None
+        self.__dimensions = None
+        self.__window = None
+        self.__page_source = None
+        if self.__configuration.scale_memo_path:
+            ImageRecognition.load_scale_memo(
+                self.__configuration.scale_memo_path
+            )
 
     def switch_to_context(self, context=0, last=False):
         """
@@ -61,6 +81,7 @@ class TestUIDriver:
         :param last: if True, switch to the last context
         :return: TestUIDriver
         """
+        self.invalidate_snapshots()
         if last:
             context = len(self.__appium_driver.contexts) - 1
         try:
@@ -115,6 +136,7 @@ class TestUIDriver:
         :param params:
         :return: dict of the result of executed script
         """
+        self.invalidate_snapshots()
         return self.driver.execute(driver_command, params)
 
     def remove_log_file(self, when_no_errors=True):
@@ -139,6 +161,7 @@ class TestUIDriver:
         Will return an ActionChains object for the current driver.
         :return: ActionChains
         """
+        self.invalidate_snapshots()
         return ActionChains(self.driver)
 
     def open_notifications(self):
@@ -147,6 +170,7 @@ class TestUIDriver:
         for Appium Drivers only
         :return: TestUIDriver
         """
+        self.invalidate_snapshots()
         self.driver.open_notifications()
         return self
 
@@ -155,6 +179,7 @@ class TestUIDriver:
         Will perform a back action on the device in browser history.
         :return: TestUIDriver
         """
+        self.invalidate_snapshots()
         self.driver.back()
         return self
 
@@ -165,6 +190,11 @@ class TestUIDriver:
         :return:
         """
         self.driver.quit()
+        artifact_writer.flush()
+        if self.__configuration.scale_memo_path:
+            ImageRecognition.save_scale_memo(
+                self.__configuration.scale_memo_path
+            )
         if self.__process is not None and stop_server:
             self.__process.kill()
 
@@ -174,6 +204,7 @@ class TestUIDriver:
         :param url:
         :return: TestUIDriver
         """
+        self.invalidate_snapshots()
         self.driver.get(url)
         logger.log(f"{self.device_name}: Navigating to: {url}")
         return self
@@ -185,6 +216,7 @@ class TestUIDriver:
         :param args:
         :return: dict of the result of executed script
         """
+        self.invalidate_snapshots()
         return self.driver.execute_script(driver_command, args)
 
     @property
@@ -203,6 +235,7 @@ class TestUIDriver:
         :param number:
         :return: TestUIDriver
         """
+        self.invalidate_snapshots()
         self.driver.set_network_connection(number)
         return self
 
@@ -222,6 +255,8 @@ class TestUIDriver:
             assertion=False,
             not_found=False,
             image_match="",
+            region=None,
+            ratio=1,
     ) -> bool:
         """
         Will find an image match based on the comparison type and threshold
@@ -231,35 +266,189 @@ class TestUIDriver:
         :param assertion:
         :param not_found:
         :param image_match:
+        :param region: only search within this part of the screen, given as
+        a (x, y, width, height) rectangle in screenshot pixels or an Elements
+        instance
+        :param ratio: click to image dimension ratio, to convert the bounds
+        of an Elements region to screenshot pixels
         :return: bool
         """
         now = datetime.now()
         current_time = now.strftime("%Y-%m-%d%H%M%S")
         image_name = f"{self.device_udid}{current_time}.png"
-        image_path = self.save_screenshot(image_name)
+        region = self.__image_region(region, ratio)
+        png = self.get_screenshot_as_png()
         comparison = os.path.join(
             self.__configuration.screenshot_path,
             comparison
         )
         found, p = ImageRecognition(
-            image_path,
+            self.__decode_screenshot(png),
             comparison,
             threshold,
             self.device_name,
             self.configuration.screenshot_path,
+            region,
+            self.device_udid or self.device_name,
+            self.__configuration.match_profile,
+            self.__configuration.cache_image_results,
         ).compare(image_match)
         if assertion and not found and not not_found:
+            if self.__configuration.save_screenshot_on_fail:
+                self.save_failure_artifacts(image_name, png)
             exception = self.new_error_message(
                 "The images compared did not match"
                 f"Threshold={threshold}, matched = {p}"
             )
             logger.log_error(error_with_traceback(exception))
             raise Exception(exception)
-        os.remove(image_path)
 
         return found
 
-    def click_by_image(self, image: str, threshold=0.9, webview=False, ratio=1):
+    def find_image_matches(
+            self,
+            comparisons,
+            threshold=0.90,
+            assertion=False,
+            region=None,
+            ratio=1,
+    ) -> dict:
+        """
+        Will find several images within the same screenshot of the current
+        screen. The screenshot is only taken and downsampled once for all of
+        them.
+        :param comparisons: list of images to search for
+        :param threshold:
+        :param assertion: raise an error if any of the images is not found
+        :param region: only search within this part of the screen, given as
+        a (x, y, width, height) rectangle in screenshot pixels or an Elements
+        instance
+        :param ratio: click to image dimension ratio, to convert the bounds
+        of an Elements region to screenshot pixels
+        :return: dict with the "found", "score" and "center" of each image
+        """
+        now = datetime.now()
+        current_time = now.strftime("%Y-%m-%d%H%M%S")
+        image_name = f"{self.device_udid}{current_time}.png"
+        region = self.__image_region(region, ratio)
+        png = self.get_screenshot_as_png()
+        paths = {
+            os.path.join(self.__configuration.screenshot_path, comparison):
+                comparison
+            for comparison in comparisons
+        }
+        results = compare_images_batch(
+            self.__decode_screenshot(png),
+            list(paths),
+            threshold,
+            path=self.configuration.screenshot_path,
+            region=region,
+            device=self.device_udid or self.device_name,
+            profile=self.__configuration.match_profile,
+            cache=self.__configuration.cache_image_results,
+        )
+        matches = {
+            comparison: results[full_path]
+            for full_path, comparison in paths.items()
+        }
+        missing = [
+            comparison
+            for comparison, match in matches.items()
+            if not match["found"]
+        ]
+        if assertion and missing:
+            if self.__configuration.save_screenshot_on_fail:
+                self.save_failure_artifacts(image_name, png)
+            exception = self.new_error_message(
+                f"The images {missing} were not found in the screen. "
+                f"Threshold={threshold}"
+            )
+            logger.log_error(error_with_traceback(exception))
+            raise Exception(exception)
+
+        return matches
+
+    def wait_until_screen_stable(
+            self, threshold=1.0, window=3, timeout=10, assertion=True
+    ) -> bool:
+        """
+        Will wait until the screen stops changing, e.g. until an animation
+        ends. Screenshots are taken back to back, decoded in grayscale at a
+        quarter of their resolution and compared with the previous one.
+        :param threshold: mean difference (0-255) between two consecutive
+        screenshots under which the screen is considered unchanged
+        :param window: number of consecutive unchanged screenshots needed
+        :param timeout: seconds to wait
+        :param assertion: raise an error if the screen is still changing
+        after the timeout
+        :return: bool
+        """
+        start = time.time()
+        previous = None
+        stable = 0
+        while time.time() < start + timeout:
+            frame = thumbnail_from_bytes(self.driver.get_screenshot_as_png())
+            if (
+                previous is not None
+                and previous.shape == frame.shape
+                and frame_difference(previous, frame) <= threshold
+            ):
+                stable += 1
+                if stable >= window:
+                    logger.log(
+                        f"{self.device_name}: Screen stable after "
+                        f"{time.time() - start:.2f}s"
+                    )
+                    return True
+            else:
+                stable = 0
+            previous = frame
+        if assertion:
+            exception = self.new_error_message(
+                f"The screen kept changing for {timeout}s"
+            )
+            logger.log_error(error_with_traceback(exception))
+            raise Exception(exception)
+
+        return False
+
+    def find_image_occurrences(
+            self, comparison, threshold=0.90, region=None, ratio=1
+    ) -> list:
+        """
+        Will find all the occurrences of an image within the current screen,
+        e.g. every icon of a list, with a single search.
+        :param comparison: image to search for
+        :param threshold:
+        :param region: only search within this part of the screen, given as
+        a (x, y, width, height) rectangle in screenshot pixels or an Elements
+        instance
+        :param ratio: click to image dimension ratio, to convert the bounds
+        of an Elements region to screenshot pixels
+        :return: list of the (x, y) centers of the occurrences in screenshot
+        pixels, top to bottom and left to right
+        """
+        matches = ImageRecognition(
+            self.get_screenshot_as_image(),
+            comparison,
+            threshold,
+            self.device_name,
+            path="",
+            region=self.__image_region(region, ratio),
+            profile=self.__configuration.match_profile,
+        ).get_matches()
+        return [match.center for match in matches]
+
+    def click_by_image(
+            self,
+            image: str,
+            threshold=0.9,
+            webview=False,
+            ratio=1,
+            region=None,
+            index=None,
+            timeout=0,
+    ):
         """
         Will click on an element based on the image provided if it can be found
         within the current screen.
@@ -267,43 +456,214 @@ class TestUIDriver:
         :param threshold: limit for comparison
         :param webview: Mobile webview requires a shift in Y coordinates
         :param ratio: click to image dimension ratio
+        :param region: only search within this part of the screen, given as
+        a (x, y, width, height) rectangle in screenshot pixels or an Elements
+        instance
+        :param index: None clicks the best match of the image. 0, 1, 2...
+        click that occurrence of the image, counting top to bottom and left
+        to right from 0, see find_image_occurrences
+        :param timeout: seconds to keep looking for the image, or for that
+        occurrence of it, e.g. while the screen is loading, see tap_image
         :return: TestUIDriver
         """
-        now = datetime.now()
-        current_time = now.strftime("%Y-%m-%d%H%M%S")
-        image_name = f"{self.device_udid}{current_time}.png"
-        im_path = self.save_screenshot(image_name)
-        x, y = get_point_match(im_path, image, threshold, self.device_name)
-        x = int(x * ratio)
-        y = int(y * ratio)
-        if webview:
-            y = y - 120
+        region = self.__image_region(region, ratio)
+        if index is None:
+            match, _ = self.__locate_image(image, threshold, region, timeout)
+            x, y = match.center
+        else:
+            occurrences, _ = self.__retry(
+                lambda: self.find_image_occurrences(image, threshold, region),
+                lambda found: len(found) > index,
+                timeout,
+            )
+            if len(occurrences) <= index:
+                exception = self.new_error_message(
+                    f"The image {image} was found {len(occurrences)} times, "
+                    f"can't click on occurrence {index}"
+                )
+                logger.log_error(error_with_traceback(exception))
+                raise Exception(exception)
+            x, y = occurrences[index]
+        x, y = self.__image_point(x, y, ratio, webview)
         self.click(x, y)
         logger.log(
             f"{self.device_name}: element with image {image}"
             f" clicking on point ({x},{y})"
         )
-        self.click(x, y)
-
-        self.__delete_screenshot(im_path)
 
         return self
 
+    def tap_image(
+            self,
+            image: str,
+            threshold=0.9,
+            timeout=0,
+            assertion=True,
+            webview=False,
+            ratio=1,
+            region=None,
+    ) -> dict:
+        """
+        Will take screenshots in memory until the image is found or the
+        timeout expires, waiting longer between screenshots each time, and
+        tap once on its center. Unlike click_by_image, nothing is tapped when
+        the image is not found.
+        :param image: Image to tap on
+        :param threshold: limit for comparison
+        :param timeout: seconds to keep looking for the image, 0 to only
+        look once
+        :param assertion: raise an error if the image is not found
+        :param webview: Mobile webview requires a shift in Y coordinates
+        :param ratio: click to image dimension ratio
+        :param region: only search within this part of the screen, given as
+        a (x, y, width, height) rectangle in screenshot pixels or an Elements
+        instance
+        :return: dict with "found", "score", "point" tapped (None if not
+        found), "attempts" and "duration" in seconds
+        """
+        start = time.time()
+        region = self.__image_region(region, ratio)
+        match, attempts = self.__locate_image(
+            image, threshold, region, timeout
+        )
+        result = {
+            "found": match.score > threshold,
+            "score": match.score,
+            "point": None,
+            "attempts": attempts,
+            "duration": 0.0,
+        }
+        if result["found"]:
+            point = self.__image_point(*match.center, ratio, webview)
+            result["point"] = point
+            self.click(*point)
+        result["duration"] = time.time() - start
+        logger.log(
+            f"{self.device_name}: image {image} tapped on point "
+            f"{result['point']} after {result['duration']:.2f}s, "
+            f"matched = {match.score}"
+        )
+        if assertion and not result["found"]:
+            exception = self.new_error_message(
+                f"The image {image} was not found after {attempts} attempts. "
+                f"Threshold={threshold}, matched = {match.score}"
+            )
+            logger.log_error(error_with_traceback(exception))
+            raise Exception(exception)
+
+        return result
+
+    def __locate_image(self, image, threshold, region, timeout):
+        """
+        Will search the image in in-memory screenshots until it is found or
+        the timeout expires, doubling the wait between attempts up to 2s.
+        :param image: Image to search for
+        :param threshold: limit for comparison
+        :param region: rectangle in screenshot pixels or None
+        :param timeout: seconds to keep looking for the image
+        :return: (best ImageMatch of the last attempt, number of attempts)
+        """
+        return self.__retry(
+            lambda: get_match(
+                self.get_screenshot_as_image(),
+                image,
+                threshold,
+                region,
+                self.device_udid or self.device_name,
+                self.__configuration.match_profile,
+                self.__configuration.cache_image_results,
+            ),
+            lambda match: match.score > threshold,
+            timeout,
+        )
+
+    def __retry(self, search, found, timeout):
+        """
+        Will repeat a search on a new screenshot until it finds what it looks
+        for or the timeout expires, doubling the wait between attempts up to
+        2s.
+        :param search: function searching the current screen
+        :param found: function telling if the result of the search is found
+        :param timeout: seconds to keep searching
+        :return: (result of the last attempt, number of attempts)
+        """
+        start = time.time()
+        backoff = 0.2
+        attempts = 0
+        while True:
+            attempts += 1
+            result = search()
+            remaining = start + timeout - time.time()
+            if found(result) or remaining <= 0:
+                return result, attempts
+            time.sleep(min(backoff, remaining))
+            backoff = min(backoff * 2, 2)
+            self.invalidate_snapshots()
+
+    @staticmethod
+    def __image_region(region, ratio):
+        """
+        Will convert an element used as region of interest to a rectangle in
+        screenshot pixels, as element bounds are in click coordinates.
+        :param region: rectangle, element or None
+        :param ratio: click to image dimension ratio
+        :return: rectangle or None
+        """
+        if hasattr(region, "location") and hasattr(region, "dimensions"):
+            location, dimensions = region.location, region.dimensions
+            region = (
+                location.x / ratio,
+                location.y / ratio,
+                dimensions.x / ratio,
+                dimensions.y / ratio,
+            )
+        return region
+
+    @staticmethod
+    def __image_point(x, y, ratio, webview):
+        """
+        Will convert a point in screenshot pixels to click coordinates.
+        :param x:
+        :param y:
+        :param ratio: click to image dimension ratio
+        :param webview: Mobile webview requires a shift in Y coordinates
+        :return: (x, y)
+        """
+        x = int(x * ratio)
+        y = int(y * ratio)
+        if webview:
+            y = y - 120
+        return x, y
+
     def get_dimensions(self):
         """
-        Will return the dimensions of the current screen.
-        :return:
+        Will return the dimensions of the current screen, in screenshot
+        pixels. They are read from the header of a screenshot only once per
+        session, and again when the window size changes, e.g. on rotation.
+        The window size is only asked to the driver again after an action,
+        see invalidate_snapshots.
+        :return: Dimensions
+        """
+        if self.__window is None:
+            # kept in a tuple to also remember drivers that don't report it
+            self.__window = (self.__window_size(),)
+        window = self.__window[0]
+        if self.__dimensions is None or self.__dimensions[0] != window:
+            width, height = size_from_bytes(self.get_screenshot_as_png())
+            logger.log(f"The size of the screen is {(width, height)}")
+            self.__dimensions = (window, (width, height))
+        return Dimensions(*self.__dimensions[1])
+
+    def __window_size(self):
+        """
+        Will return the window size reported by the driver, which changes with
+        the orientation, or None if the driver doesn't report it.
+        :return: dict or None
         """
-        now = datetime.now()
-        current_time = now.strftime("%Y-%m-%d%H%M%S")
-        image_name = f"{self.device_udid}{current_time}.png"
-        path_s = self.save_screenshot(image_name)
-        dimensions = ImageRecognition(
-            original=path_s, path=""
-        ).image_original_size()
-        logger.log(f"Deleting screenshot: {path_s}")
-        self.__delete_screenshot(path_s)
-        return dimensions
+        try:
+            return self.driver.get_window_size()
+        except WebDriverException:
+            return None
 
     def click(self, x, y):
         """
@@ -313,6 +673,7 @@ class TestUIDriver:
         :param y:
         :return: TestUIDriver
         """
+        self.invalidate_snapshots()
         actions = self.actions()
         actions.w3c_actions.pointer_action.move_to_location(x=x, y=y)
         actions.w3c_actions.pointer_action.click()
@@ -321,6 +682,74 @@ class TestUIDriver:
         logger.log(f'Clicked over "x={x}: y={y}"')
         return self
 
+    def get_screenshot_as_png(self) -> bytes:
+        """
+        Will take a screenshot of the current screen as PNG. When
+        configuration.screenshot_cache_ttl is set, a screenshot taken less
+        than those seconds ago is reused if no action was done since then.
+        :return: bytes of the PNG screenshot
+        """
+        ttl = self.__configuration.screenshot_cache_ttl
+        cached = self.__screenshot
+        if ttl and cached is not None and time.time() - cached[0] < ttl:
+            return cached[1]
+        taken = time.time()
+        png = self.driver.get_screenshot_as_png()
+        self.__screenshot = [taken, png, None] if ttl else None
+        return png
+
+    def get_screenshot_as_image(self):
+        """
+        Will take a screenshot of the current screen and decode it in memory,
+        without saving it to disk. The screenshot is reused like in
+        get_screenshot_as_png.
+        :return: numpy array with the screenshot in BGR format
+        """
+        return self.__decode_screenshot(self.get_screenshot_as_png())
+
+    def invalidate_snapshots(self):
+        """
+        Will discard the screenshot kept for screenshot_cache_ttl, the page
+        source snapshot and the window size checked by get_dimensions, so
+        the next checks see the screen again. Actions done through
+        TestUIDriver and Elements call it, actions done directly on the
+        driver, e.g. rotating it, must call it.
+        :return: TestUIDriver
+        """
+        self.__screenshot = None
+        self.__window = None
+        self.__page_source = None
+        return self
+
+    def get_page_source_snapshot(self, refresh=False):
+        """
+        Will return the native page source parsed with lxml, fetched once
+        until the next action, to evaluate XPath and attributes locally.
+        :param refresh: fetch the page source again even if no action was
+        done, e.g. when polling for a change
+        :return: PageSource, None in browsers and web views
+        """
+        if self.browser:
+            return None
+        if refresh or self.__page_source is None:
+            # kept in a tuple to also remember web views, parsed as None
+            self.__page_source = (PageSource.parse(self.driver.page_source),)
+        return self.__page_source[0]
+
+    def __decode_screenshot(self, png: bytes):
+        """
+        Will decode a PNG screenshot, only once if it is the cached one.
+        :param png: PNG encoded screenshot
+        :return: numpy array in BGR format
+        """
+        cached = self.__screenshot
+        if cached is None or cached[1] is not png:
+            return image_from_bytes(png)
+        if cached[2] is None:
+            cached[2] = image_from_bytes(png)
+        # the matcher may draw on the image, so the cached one is not shared
+        return cached[2].copy()
+
     def save_screenshot(self, image_name="") -> str:
         """
         Will save a screenshot of the current screen. If no image_name is
@@ -328,6 +757,46 @@ class TestUIDriver:
         :param image_name:
         :return: str of the path where the screenshot was saved.
         """
+        return self.__write_screenshot(
+            self.driver.get_screenshot_as_png(), image_name
+        )
+
+    def save_failure_artifacts(self, image_name="", png: bytes = None):
+        """
+        Will save a screenshot of the current screen, and its page source if
+        configuration.save_page_source_on_fail is set, in the background.
+        Only the capture is done in the calling thread; the files are written
+        by the artifact writer, which raise_errors and quit wait for.
+        :param image_name:
+        :param png: already taken PNG screenshot, a new one by default
+        :return: str of the path where the screenshot will be saved.
+        """
+        final_path = self.__screenshot_file(image_name)
+        if png is None:
+            png = self.driver.get_screenshot_as_png()
+        artifact_writer.write(final_path, png)
+        if self.__configuration.save_page_source_on_fail:
+            try:
+                artifact_writer.write(
+                    path.splitext(final_path)[0] + ".xml",
+                    self.driver.page_source,
+                )
+            except WebDriverException as error:
+                logger.log_warn(
+                    self.new_error_message(
+                        f"Could not get the page source: {error}"
+                    )
+                )
+
+        return final_path
+
+    def __screenshot_file(self, image_name="") -> str:
+        """
+        Will return where a screenshot is saved, in the screenshot path.
+        :param image_name: name of the file, generated from the current time
+        if empty
+        :return: str of the path
+        """
         config = self.__configuration
 
         log_dir = config.screenshot_path
@@ -335,16 +804,25 @@ class TestUIDriver:
             log_dir = "./logs"
             log_dir = path.join(log_dir, "report_screenshots")
 
-        Path(log_dir).mkdir(parents=True, exist_ok=True)
-
         current_time = datetime.now().strftime("%Y-%m-%d%H%M%S")
 
         if not image_name:
             image_name = f"ERROR-{self.device_name}-{current_time}.png"
 
-        final_path = path.join(log_dir, image_name)
+        return path.join(log_dir, image_name)
+
+    def __write_screenshot(self, png: bytes, image_name="") -> str:
+        """
+        Will write an already taken PNG screenshot in the screenshot path.
+        :param png: PNG encoded screenshot
+        :param image_name:
+        :return: str of the path where the screenshot was saved.
+        """
+        final_path = self.__screenshot_file(image_name)
+        Path(final_path).parent.mkdir(parents=True, exist_ok=True)
 
-        self.driver.save_screenshot(final_path)
+        with open(final_path, "wb") as file:
+            file.write(png)
 
         logger.log_debug(
             self.new_error_message(f'Screenshot saved in "{final_path}"')
@@ -352,15 +830,6 @@ class TestUIDriver:
 
         return final_path
 
-    @classmethod
-    def __delete_screenshot(cls, image_name):
-        """
-        Will delete the provided screenshot.
-        :param image_name:
-        :return:
-        """
-        os.remove(image_name)
-
     @property
     def driver(self) -> WebDriver:
         """
@@ -402,6 +871,7 @@ class TestUIDriver:
         :param remove_log_file: If True, appium logs will be deleted.
         :return:
         """
+        artifact_writer.flush()
         if len(self.errors) != 0:
             composed_error = "\n"
             i = 1
@@ -442,6 +912,7 @@ class TestUIDriver:
         :param seconds: The seconds to background the app.
         :return: TestUIDriver
         """
+        self.invalidate_snapshots()
         self.driver.background_app(seconds)
         return self
 
@@ -451,6 +922,7 @@ class TestUIDriver:
         :param app_id: The app id to remove.
         :return: TestUIDriver
         """
+        self.invalidate_snapshots()
         self.driver.remove_app(app_id)
         return self
 
@@ -460,6 +932,7 @@ class TestUIDriver:
         :param app_id: The app id to install.
         :return: TestUIDriver
         """
+        self.invalidate_snapshots()
         self.driver.install_app(app_id)
         return self
 
@@ -494,6 +967,7 @@ class TestUIDriver:
             not_found=False,
             keep_image_as="",
             assertion=True,
+            processes=0,
     ) -> bool:
         """
         Stop recording the screen and compare the video with the given image
@@ -503,6 +977,8 @@ class TestUIDriver:
         :param not_found:
         :param keep_image_as:
         :param assertion:
+        :param processes: if not 0, the video frames are compared in a pool
+        of processes of that size (None for one per CPU)
         :return: True if the image was found in the video, False otherwise
         """
         now = datetime.now()
@@ -516,7 +992,11 @@ class TestUIDriver:
             threshold,
             device_name=self.device_name,
             path=log_dir
-        ).compare_video(keep_image_as, frame_rate_reduction=fps_reduction)
+        ).compare_video(
+            keep_image_as,
+            frame_rate_reduction=fps_reduction,
+            processes=processes,
+        )
 
         os.remove(os.path.join(log_dir, video_name))
         if not found and not not_found:
@@ -555,5 +1035,6 @@ class TestUIDriver:
         This method is meant for Appium Drivers Only.
         :return: TestUIDriver
         """
+        self.invalidate_snapshots()
         self.driver.hide_keyboard()
         return self
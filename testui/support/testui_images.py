@@ -1,16 +1,25 @@
+import copy
+import hashlib
+import json
 import os
 import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
 
 import cv2
 import numpy as np
-import imutils
 
 from testui.support import logger
 
-found_image = False
-matched = 0.0
-matching_list = []
+MATCH_THREADS = 5
+# minimum template to image area ratio matched in the frequency domain
+FFT_RATIO = 0.25
+# bigger buffers are allocated on every use instead of being kept, unless
+# the screenshots need them, see WorkspacePool.fit
+MAX_BUFFER_BYTES = 16 * 1024 * 1024
 
 
 def compare_video_image(
@@ -21,362 +30,2452 @@ def compare_video_image(
     frame_rate_reduction=1,
     max_scale=2.0,
     path="",
+    min_change=0,
 ):
     """
-    Compare an image to a video and return the percentage of similarity
+    Compare an image to a video and return the percentage of similarity.
+    Frames discarded by the frame rate reduction are skipped without being
+    decoded, and frames that did not change since the last evaluated one are
+    not evaluated again.
     :param video: the video to compare
     :param comparison: the image to compare
     :param threshold: the threshold of similarity
     :param image_match: the image to save if a match is found
     :param frame_rate_reduction: the frame rate reduction
     :param max_scale: the maximum scale of the image
+    :param min_change: frames whose pixels all differ by this much or less
+    (0-255) from the last evaluated frame are skipped. 0 only skips frames
+    that are identical
     :return: True if a match is found, False otherwise
     """
-    global matching_list
-    global matched
-    global found_image
+    root_dir = path
+    logger.log_debug(f"root directory: {root_dir}")
+    cap = cv2.VideoCapture(os.path.join(root_dir, video))
+    template_path = os.path.join(root_dir, comparison)
+    if not os.path.exists(template_path):
+        logger.log_warn(
+            "trying to compare with an image that doesn't exist!"
+            f"{template_path}"
+        )
+        return False, 0.0
+    start = time.time()
+    stats = MatchStats("compare_video_image", threshold)
+    stats.frames = 0
+    template = template_cache.get(template_path, stats)
+    i = -1
+    best = ImageMatch()
+    found_at = None
+    previous = None
+    while cap.isOpened():
+        i += 1
+        if i % frame_rate_reduction != 0:
+            # move to the next frame without decoding it
+            if not cap.grab():
+                break
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+        thumbnail = frame_thumbnail(frame)
+        if frame_unchanged(thumbnail, previous, min_change):
+            continue
+        previous = thumbnail
+        logger.log(f"frame evaluation = {i}")
+        if stats.image_size is None:
+            stats.describe(comparison, frame, template)
+        stats.frames += 1
+        match = pyramid_match(
+            frame, template, threshold, max_scale, 0.1, stats=stats
+        )
+        if match.score > best.score:
+            best = match
+        if match.score > threshold:
+            found_at = (i, frame)
+            break
+    cap.release()
+    stats.finish(best, start)
+    telemetry.emit(stats)
+    if found_at is None:
+        return False, best.score
+    i, frame = found_at
+    if image_match != "":
+        draw_rectangle(frame, best, os.path.join(root_dir, image_match))
+    logger.log(f"Match found in the {i}th frame of the video")
+    return True, best.score
+
+
+def compare_video_image_parallel(
+    video,
+    comparison,
+    threshold,
+    image_match,
+    frame_rate_reduction=1,
+    max_scale=2.0,
+    path="",
+    processes=None,
+    chunk_size=8,
+    min_change=0,
+):
+    """
+    Compare an image to a video using a pool of processes. The frames that
+    need to be evaluated are decoded in this process and sent in chunks to
+    the pool through shared memory, and each process evaluates the frames of
+    its chunk in order. The earliest matching frame wins.
+    :param video: the video to compare
+    :param comparison: the image to compare
+    :param threshold: the threshold of similarity
+    :param image_match: the image to save if a match is found
+    :param frame_rate_reduction: the frame rate reduction
+    :param max_scale: the maximum scale of the image
+    :param processes: size of the pool, number of CPUs by default
+    :param chunk_size: number of frames sent to a process at once
+    :param min_change: frames whose pixels all differ by this much or less
+    (0-255) from the last evaluated frame are skipped. 0 only skips frames
+    that are identical
+    :return: (found, score, frame index or None) tuple
+    """
+    root_dir = path
+    template_path = os.path.join(root_dir, comparison)
+    if not os.path.exists(template_path):
+        logger.log_warn(
+            "trying to compare with an image that doesn't exist!"
+            f"{template_path}"
+        )
+        return False, 0.0, None
+    start = time.time()
+    stats = MatchStats("compare_video_image_parallel", threshold)
+    stats.frames = 0
+    template = template_cache.get(os.path.abspath(template_path), stats)
+    cap = cv2.VideoCapture(os.path.join(root_dir, video))
+    processes = processes or os.cpu_count() or 1
+    pending = []
+    result = (False, 0.0, None)
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for indexes, frames in __frame_chunks(
+                cap, frame_rate_reduction, chunk_size, min_change
+            ):
+                if stats.image_size is None:
+                    stats.describe(comparison, frames[0], template)
+                memory = shared_memory.SharedMemory(
+                    create=True, size=frames.nbytes
+                )
+                # registered before submitting, so it is always released
+                pending.append((memory, frames.shape, None))
+                np.ndarray(frames.shape, frames.dtype, memory.buf)[:] = frames
+                future = executor.submit(
+                    _match_frames,
+                    memory.name,
+                    frames.shape,
+                    indexes,
+                    os.path.abspath(template_path),
+                    threshold,
+                    max_scale,
+                )
+                pending[-1] = (memory, frames.shape, future)
+                # keep the memory bounded, and stop decoding once the
+                # earliest chunk in flight has a match
+                while (
+                    not result[0]
+                    and pending
+                    and (len(pending) >= processes * 2 or pending[0][2].done())
+                ):
+                    result = __collect_chunk(pending, result, threshold, stats)
+                if result[0]:
+                    break
+            while not result[0] and pending:
+                result = __collect_chunk(pending, result, threshold, stats)
+            executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        for memory, _, _ in pending:
+            memory.close()
+            memory.unlink()
+        cap.release()
+
+    found, score, frame = result
+    stats.finish(frame[2] if found else ImageMatch(score), start)
+    telemetry.emit(stats)
+    if found:
+        logger.log(f"Match found in the {frame[0]}th frame of the video")
+        if image_match != "":
+            draw_rectangle(
+                frame[1], frame[2], os.path.join(root_dir, image_match)
+            )
+        return True, score, frame[0]
+    return False, score, None
+
+
+def __frame_chunks(cap, frame_rate_reduction, chunk_size, min_change):
+    """
+    Decodes the frames of a video that need to be evaluated, skipping the
+    ones discarded by the frame rate reduction and the ones that did not
+    change, and yields them in chunks
+    :param cap: cv2.VideoCapture
+    :param frame_rate_reduction: the frame rate reduction
+    :param chunk_size: number of frames of every chunk
+    :param min_change: maximum pixel difference (0-255) with the last
+    evaluated frame of the skipped frames
+    :return: generator of (frame indexes, numpy array of frames)
+    """
+    indexes = []
+    frames = []
+    previous = None
+    i = -1
+    while cap.isOpened():
+        i += 1
+        if i % frame_rate_reduction != 0:
+            if not cap.grab():
+                break
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+        thumbnail = frame_thumbnail(frame)
+        if frame_unchanged(thumbnail, previous, min_change):
+            continue
+        previous = thumbnail
+        indexes.append(i)
+        frames.append(frame)
+        if len(frames) == chunk_size:
+            yield indexes, np.stack(frames)
+            indexes, frames = [], []
+    if frames:
+        yield indexes, np.stack(frames)
+
+
+def __collect_chunk(
+    pending: list, result: tuple, threshold: float, stats
+) -> tuple:
+    """
+    Waits for the oldest chunk sent to the pool and releases its memory
+    :param pending: list of (shared memory, frames, future) in order
+    :param result: (found, score, frame) result so far
+    :param threshold: the threshold of similarity
+    :param stats: MatchStats where the frames and scales of the chunk are
+    added
+    :return: (found, score, frame) where frame is (index, image, ImageMatch)
+    """
+    memory, shape, future = pending.pop(0)
+    try:
+        ((index, position), match), chunk = future.result()
+        stats.frames += chunk.frames
+        stats.scales += chunk.scales
+        if chunk.exit_scale is not None:
+            stats.exit_scale = chunk.exit_scale
+        if match.score > threshold:
+            image = np.ndarray(shape, np.uint8, memory.buf)[position].copy()
+            return True, match.score, (index, image, match)
+        return False, max(result[1], match.score), None
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def _match_frames(
+    memory_name, shape, indexes, template_path, threshold, max_scale
+):
+    """
+    Evaluates a chunk of frames kept in shared memory in a pool process
+    :param memory_name: name of the shared memory block
+    :param shape: shape of the array of frames
+    :param indexes: video index of every frame
+    :param template_path: absolute path of the template
+    :param threshold: the threshold of similarity
+    :param max_scale: the maximum scale of the image
+    :return: (((video index, chunk position), ImageMatch), MatchStats) with
+    the first match, or the best frame when there is no match, and the
+    frames and scales evaluated
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    template = template_cache.get(template_path)
+    stats = MatchStats("_match_frames", threshold)
+    stats.frames = 0
+    best = ((None, None), ImageMatch())
+    for position, index in enumerate(indexes):
+        frame = np.ndarray(shape, np.uint8, memory.buf)[position]
+        stats.frames += 1
+        match = pyramid_match(
+            frame, template, threshold, max_scale, 0.1, stats=stats
+        )
+        # the view has to be released before the memory can be closed
+        del frame
+        if match.score > best[1].score or match.score > threshold:
+            best = ((index, position), match)
+        if match.score > threshold:
+            break
+    memory.close()
+    return best, stats
+
+
+def frame_thumbnail(frame, width=64):
+    """
+    Small grayscale copy of a frame, used to detect scene changes
+    :param frame: the frame
+    :param width: width of the thumbnail
+    :return: numpy array
+    """
+    height = max(int(frame.shape[0] * width / frame.shape[1]), 1)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def frame_unchanged(thumbnail, previous, min_change=0) -> bool:
+    """
+    Whether a frame can be skipped because no pixel of its thumbnail changed
+    more than min_change. The maximum is used instead of the mean so a small
+    icon appearing in a big frame is not averaged away.
+    :param thumbnail: thumbnail of the frame
+    :param previous: thumbnail of the last evaluated frame, or None
+    :param min_change: maximum pixel difference (0-255) of unchanged frames
+    :return: bool
+    """
+    if previous is None:
+        return False
+    return int(cv2.absdiff(thumbnail, previous).max()) <= min_change
+
+
+def frame_difference(first, second) -> float:
+    """
+    Mean absolute difference between two thumbnails of the same size
+    :param first: thumbnail
+    :param second: thumbnail
+    :return: float from 0 (identical) to 255
+    """
+    return float(cv2.absdiff(first, second).mean())
+
+
+class ImageMatch:
+    """
+    Result of a template match. Coordinates are given in pixels of the
+    original (not resized) image.
+    """
+
+    def __init__(self, score=0.0, x=0, y=0, width=0, height=0, scale=1.0):
+        self.score = score
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.scale = scale
+
+    @property
+    def center(self):
+        """
+        Middle point of the matched region
+        :return: (x, y) tuple
+        """
+        return self.x + self.width // 2, self.y + self.height // 2
+
+
+class MatchProfile:
+    """
+    How much of the images is used to match them: the channels, the
+    resolution and the cv2.matchTemplate method. Only normalized methods are
+    supported, so scores can be compared against the same thresholds.
+    """
+
+    def __init__(
+        self,
+        gray=False,
+        factor=1.0,
+        method=cv2.TM_CCOEFF_NORMED,
+        features=False,
+    ):
+        """
+        :param gray: match grayscale images instead of BGR
+        :param factor: factor applied to the resolution of both images
+        :param method: cv2.TM_CCOEFF_NORMED, cv2.TM_CCORR_NORMED or
+        cv2.TM_SQDIFF_NORMED
+        :param features: locate the template with ORB keypoints first, see
+        feature_match, and only sweep the scales if it isn't found that way
+        """
+        if method not in (
+            cv2.TM_CCOEFF_NORMED,
+            cv2.TM_CCORR_NORMED,
+            cv2.TM_SQDIFF_NORMED,
+        ):
+            raise Exception(f"Match method {method} is not normalized")
+        self.gray = gray
+        self.factor = factor
+        self.method = method
+        self.features = features
+
+    def prepare(self, image, factor=None):
+        """
+        Converts an image to the channels and resolution of the profile
+        :param image: BGR numpy array
+        :param factor: factor to use instead of the one of the profile
+        :return: numpy array
+        """
+        factor = self.factor if factor is None else factor
+        if self.gray and len(image.shape) == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if factor != 1.0:
+            image = cv2.resize(
+                image,
+                (
+                    max(int(image.shape[1] * factor), 1),
+                    max(int(image.shape[0] * factor), 1),
+                ),
+                interpolation=cv2.INTER_AREA,
+            )
+        return image
+
+    def factor_for(self, template, min_size=16):
+        """
+        Factor applied to a template, the one of the profile unless the
+        template would become too small to be matched reliably
+        :param template: numpy array
+        :param min_size: minimum size in pixels of the downsampled template
+        :return: float
+        """
+        if min(template.shape[:2]) * self.factor < min_size:
+            return 1.0
+        return self.factor
+
+
+MATCH_PROFILES = {
+    "fast": MatchProfile(True, 0.5),
+    "balanced": MatchProfile(True),
+    "exact": MatchProfile(),
+    "features": MatchProfile(True, features=True),
+}
+
+
+def match_profile(profile) -> MatchProfile:
+    """
+    Resolves a profile given by name
+    :param profile: "fast", "balanced", "exact", "features", a MatchProfile
+    or None for "exact"
+    :return: MatchProfile
+    """
+    if profile is None:
+        return MATCH_PROFILES["exact"]
+    if isinstance(profile, MatchProfile):
+        return profile
+    if profile not in MATCH_PROFILES:
+        raise Exception(
+            f"Unknown match profile {profile}, "
+            f"use one of {list(MATCH_PROFILES)}"
+        )
+    return MATCH_PROFILES[profile]
+
+
+def best_score(result, method=cv2.TM_CCOEFF_NORMED):
+    """
+    Best score of a cv2.matchTemplate result and where it was found. For
+    cv2.TM_SQDIFF_NORMED the score is 1 - the minimum difference
+    :param result: cv2.matchTemplate result
+    :param method: method used in cv2.matchTemplate
+    :return: (score, (x, y)) tuple
+    """
+    (min_val, max_val, min_loc, max_loc) = cv2.minMaxLoc(result)
+    if method == cv2.TM_SQDIFF_NORMED:
+        return 1.0 - min_val, min_loc
+    return max_val, max_loc
+
+
+class Workspace:
+    """
+    Output buffers for cv2.resize and cv2.matchTemplate reused by the matches
+    run one after the other in a thread, instead of allocating new arrays
+    for every scale. Arrays returned by `array` are only valid until it is
+    called again with the same name.
+    """
+
+    def __init__(self, max_bytes=MAX_BUFFER_BYTES):
+        self.max_bytes = max_bytes
+        self.__buffers = {}
+
+    def array(self, name: str, shape: tuple, dtype=np.uint8):
+        """
+        Returns an uninitialized array backed by the buffer called `name`,
+        which grows when it is too small. Arrays bigger than max_bytes are
+        allocated without keeping them
+        :param name: name of the buffer
+        :param shape: shape of the array
+        :param dtype: numpy type of the array
+        :return: numpy array
+        """
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if size > self.max_bytes:
+            return np.empty(shape, dtype)
+        buffer = self.__buffers.get(name)
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size, np.uint8)
+            self.__buffers[name] = buffer
+        return buffer[:size].view(dtype).reshape(shape)
+
+    def resize(self, name: str, image, width: int, height: int):
+        """
+        cv2.resize with cv2.INTER_AREA into the buffer called `name`
+        :param name: name of the buffer
+        :param image: numpy array
+        :param width: width of the resized image
+        :param height: height of the resized image
+        :return: numpy array
+        """
+        dst = self.array(name, (height, width) + image.shape[2:], image.dtype)
+        return cv2.resize(
+            image, (width, height), dst=dst, interpolation=cv2.INTER_AREA
+        )
+
+    def match(self, image, template, method):
+        """
+        cv2.matchTemplate into the buffer called "result"
+        :param image: the larger image
+        :param template: the template image
+        :param method: cv2.matchTemplate method
+        :return: numpy array of scores
+        """
+        shape = (
+            image.shape[0] - template.shape[0] + 1,
+            image.shape[1] - template.shape[1] + 1,
+        )
+        result = self.array("result", shape, np.float32)
+        return cv2.matchTemplate(image, template, method, result=result)
+
+
+class WorkspacePool:
+    """
+    Workspaces lent to the worker threads of the matches. Workers are new
+    threads for every match, so their workspaces are returned to the pool
+    when they finish and the next worker gets one with its buffers already
+    allocated. Threads that don't borrow one get their own.
+    """
+
+    def __init__(self, max_size=MATCH_THREADS, max_bytes=MAX_BUFFER_BYTES):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.__free = []
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    def current(self) -> Workspace:
+        """
+        Workspace of the calling thread
+        :return: Workspace
+        """
+        workspace = getattr(self.__local, "workspace", None)
+        if workspace is None:
+            workspace = Workspace(self.max_bytes)
+            self.__local.workspace = workspace
+        workspace.max_bytes = self.max_bytes
+        return workspace
+
+    def fit(self, image):
+        """
+        Raises the size of the buffers kept to the one needed by an image,
+        so the buffers of big screenshots (e.g. 4K) are reused too. The
+        biggest buffer of an image is the float32 matchTemplate result at
+        scale 1.
+        :param image: numpy array of the screen
+        """
+        size = image.shape[0] * image.shape[1] * np.dtype(np.float32).itemsize
+        with self.__lock:
+            self.max_bytes = max(self.max_bytes, size)
+
+    @contextmanager
+    def borrowed(self):
+        """
+        Lends a workspace to the calling thread while the block runs
+        """
+        with self.__lock:
+            workspace = self.__free.pop() if self.__free else Workspace()
+            workspace.max_bytes = self.max_bytes
+        self.__local.workspace = workspace
+        try:
+            yield workspace
+        finally:
+            self.__local.workspace = None
+            with self.__lock:
+                if len(self.__free) < self.max_size:
+                    self.__free.append(workspace)
+
+
+workspaces = WorkspacePool()
+
+
+class MatchStats:
+    """
+    Counters of one image search, sent to the telemetry hooks once it ends.
+    The MatchContext of every match run for the search adds to them.
+    """
+
+    def __init__(self, operation: str, threshold: float, profile=None):
+        self.operation = operation
+        self.threshold = threshold
+        self.profile = profile if isinstance(profile, str) else None
+        self.template = ""
+        self.image_size = None
+        self.template_size = None
+        self.scales = 0
+        self.exit_scale = None
+        # frames evaluated, only in videos
+        self.frames = None
+        self.score = 0.0
+        self.found = False
+        self.duration = 0.0
+        self.cache = {}
+
+    def describe(self, comparison, image, template):
+        """
+        Records the reference image and the sizes of both images
+        :param comparison: path or numpy array of the reference image
+        :param image: numpy array of the screen
+        :param template: TemplateEntry of the reference image
+        """
+        self.template = describe_image(comparison)
+        self.image_size = (image.shape[1], image.shape[0])
+        self.template_size = (template.image.shape[1], template.image.shape[0])
+
+    def finish(self, match: ImageMatch, start: float):
+        """
+        Records the result of the search
+        :param match: best ImageMatch of the search
+        :param start: time.time() when the search started
+        """
+        self.score = float(match.score)
+        self.found = match.score > self.threshold
+        self.duration = time.time() - start
+
+    def to_dict(self) -> dict:
+        """
+        :return: dict with all the counters
+        """
+        return dict(vars(self))
+
+
+class TelemetryHooks:
+    """
+    Callbacks called with MatchStats.to_dict() after every image search, e.g.
+    to send the timings and scores to a metrics server. Errors raised by the
+    callbacks are logged and don't make the search fail.
+    """
+
+    def __init__(self):
+        self.__hooks = []
+        self.__lock = threading.Lock()
+
+    def add(self, hook):
+        """
+        :param hook: function receiving a dict
+        """
+        with self.__lock:
+            self.__hooks.append(hook)
+
+    def remove(self, hook):
+        """
+        :param hook: function previously added
+        """
+        with self.__lock:
+            if hook in self.__hooks:
+                self.__hooks.remove(hook)
+
+    def emit(self, stats: MatchStats):
+        """
+        Calls every hook with the stats of a search
+        :param stats: MatchStats
+        """
+        with self.__lock:
+            hooks = list(self.__hooks)
+        if not hooks:
+            return
+        data = stats.to_dict()
+        for hook in hooks:
+            try:
+                hook(dict(data))
+            except Exception as error:  # pylint: disable=broad-except
+                logger.log_warn(f"Image recognition telemetry failed: {error}")
+
+
+telemetry = TelemetryHooks()
+
+
+class MatchContext:
+    """
+    State of a single match call, shared by the worker threads evaluating it.
+    The first worker that goes over the threshold cancels the rest, and the
+    caller blocks in `wait` until all the workers stopped.
+    """
+
+    def __init__(self, threshold: float, stats: MatchStats = None):
+        self.threshold = threshold
+        self.stats = stats
+        self.best = ImageMatch()
+        self.__lock = threading.Lock()
+        self.__found = threading.Event()
+        self.__done = threading.Event()
+        self.__done.set()
+        self.__pending = 0
+
+    @property
+    def found(self) -> bool:
+        """
+        True once a worker went over the threshold. Workers should stop as
+        soon as this is set.
+        :return: Boolean
+        """
+        return self.__found.is_set()
+
+    def submit(self, match: ImageMatch) -> bool:
+        """
+        Records the match evaluated by a worker
+        :param match: ImageMatch
+        :return: True if the match went over the threshold
+        """
+        with self.__lock:
+            if match.score > self.best.score:
+                self.best = match
+            if match.score > self.threshold and not self.found:
+                self.__found.set()
+                if self.stats is not None:
+                    self.stats.exit_scale = float(match.scale)
+        return self.found
+
+    def evaluated(self):
+        """
+        Counts a scale evaluated by a worker
+        """
+        if self.stats is not None:
+            with self.__lock:
+                self.stats.scales += 1
+
+    def start(self, target, *args):
+        """
+        Runs target(context, *args) in a new worker thread
+        :param target: function evaluating part of the match
+        :param args: arguments for the function
+        """
+        with self.__lock:
+            self.__pending += 1
+            self.__done.clear()
+        threading.Thread(target=self.__run, args=(target, args)).start()
+
+    def wait(self, timeout=None) -> ImageMatch:
+        """
+        Blocks until all the workers stopped. Once a match is found the rest
+        of the workers stop before evaluating their next scale.
+        :param timeout: maximum seconds to wait, None to wait forever
+        :return: ImageMatch with the best match found so far
+        """
+        self.__done.wait(timeout)
+        with self.__lock:
+            return self.best
+
+    def __run(self, target, args):
+        try:
+            with workspaces.borrowed():
+                target(self, *args)
+        finally:
+            with self.__lock:
+                self.__pending -= 1
+                if self.__pending == 0:
+                    self.__done.set()
+
+
+class ImagePyramid:
+    """
+    Gaussian pyramid of an image. Downsampled levels and the resized copies
+    used for every scale are built lazily and reused between matches, so
+    several templates can be matched against one pyramid.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        workspaces.fit(image)
+        self.__levels = [image]
+        self.__resized = {}
+        self.__correlators = {}
+        self.__features = None
+        self.__lock = threading.Lock()
+
+    def level(self, number: int):
+        """
+        Returns the image downsampled `number` times with cv2.pyrDown
+        :param number: pyramid level, 0 being the original image
+        :return: numpy array
+        """
+        with self.__lock:
+            while len(self.__levels) <= number:
+                self.__levels.append(cv2.pyrDown(self.__levels[-1]))
+            return self.__levels[number]
+
+    def resized(self, number: int, scale: float):
+        """
+        Returns the pyramid level resized by the given scale. Resized copies
+        of the full resolution level are not kept, as they can be several
+        times bigger than the image itself: they are written to the
+        Workspace of the thread and are only valid until its next resize.
+        :param number: pyramid level
+        :param scale: scale applied to the level
+        :return: numpy array
+        """
+        key = (number, round(float(scale), 5))
+        resized = self.__resized.get(key)
+        if resized is None:
+            image = self.level(number)
+            width = int(image.shape[1] * scale)
+            height = int(image.shape[0] * scale)
+            if number == 0:
+                return workspaces.current().resize(
+                    "level", image, width, height
+                )
+            resized = cv2.resize(
+                image, (width, height), interpolation=cv2.INTER_AREA
+            )
+            self.__resized[key] = resized
+        return resized
+
+    def features(self):
+        """
+        Returns the ORB keypoints and descriptors of the image, computed once
+        and shared by all the templates matched against it
+        :return: (keypoints, descriptors) tuple
+        """
+        with self.__lock:
+            if self.__features is None:
+                self.__features = orb_features(self.image, 5000)
+            return self.__features
+
+    def correlator(self, number: int):
+        """
+        Returns the SpectrumCorrelator of a pyramid level, computed once and
+        shared by all the scales and templates matched against it
+        :param number: pyramid level
+        :return: SpectrumCorrelator
+        """
+        image = self.level(number)
+        with self.__lock:
+            if number not in self.__correlators:
+                self.__correlators[number] = SpectrumCorrelator(image)
+            return self.__correlators[number]
+
+
+class SpectrumCorrelator:
+    """
+    Normalized cross-correlation (cv2.TM_CCOEFF_NORMED) computed in the
+    frequency domain. The spectrum and the integral images of the image are
+    computed once, so every template matched against it only costs its own
+    FFT and an inverse FFT, whatever its size. This is faster than
+    cv2.matchTemplate for templates covering a large part of the image.
+    """
+
+    def __init__(self, image):
+        image = image.astype(np.float32)
+        if len(image.shape) == 2:
+            image = image[:, :, np.newaxis]
+        self.shape = image.shape[:2]
+        self.__size = (
+            self.__fast_length(self.shape[0]),
+            self.__fast_length(self.shape[1]),
+        )
+        # templates have zero mean, so removing the mean of the image
+        # doesn't change the correlation but keeps float32 precise enough
+        self.__spectrum = np.fft.rfft2(
+            image - image.mean(axis=(0, 1)), s=self.__size, axes=(0, 1)
+        )
+        image = image.astype(np.float64)
+        self.__sums = np.pad(
+            image.cumsum(0).cumsum(1), ((1, 0), (1, 0), (0, 0))
+        )
+        self.__squares = np.pad(
+            (image**2).sum(2).cumsum(0).cumsum(1), ((1, 0), (1, 0))
+        )
+
+    @staticmethod
+    def __fast_length(length: int) -> int:
+        """
+        Smallest length not under `length` whose only prime factors are 2,
+        3 and 5, which are the sizes the FFT is fastest for
+        :param length: int
+        :return: int
+        """
+        best = 2 * length
+        power_2 = 1
+        while power_2 < best:
+            power_3 = power_2
+            while power_3 < best:
+                power_5 = power_3
+                while power_5 < best:
+                    if power_5 >= length:
+                        best = power_5
+                    power_5 *= 5
+                power_3 *= 3
+            power_2 *= 2
+        return best
+
+    @staticmethod
+    def __window(table, height, width):
+        """
+        Sums of every height x width window, from an integral image
+        :param table: integral image
+        :param height: window height
+        :param width: window width
+        :return: numpy array
+        """
+        return (
+            table[height:, width:]
+            - table[:-height, width:]
+            - table[height:, :-width]
+            + table[:-height, :-width]
+        )
+
+    def match(self, template):
+        """
+        Same result as cv2.matchTemplate(image, template,
+        cv2.TM_CCOEFF_NORMED), except for flat windows of the image, which
+        score 0
+        :param template: numpy array with the channels of the image
+        :return: numpy array of scores
+        """
+        template = template.astype(np.float32)
+        if len(template.shape) == 2:
+            template = template[:, :, np.newaxis]
+        (t_h, t_w) = template.shape[:2]
+        (i_h, i_w) = self.shape
+        template = template - template.mean(axis=(0, 1))
+        norm = float((template.astype(np.float64) ** 2).sum())
+        spectrum = np.fft.rfft2(template, s=self.__size, axes=(0, 1))
+        # valid positions never wrap around, so the circular correlation
+        # of the image and the zero padded template is the plain one
+        correlation = np.fft.irfft2(
+            (self.__spectrum * np.conj(spectrum)).sum(2), s=self.__size
+        )[: i_h - t_h + 1, : i_w - t_w + 1]
+        count = t_h * t_w
+        variance = (
+            self.__window(self.__squares, t_h, t_w)
+            - (self.__window(self.__sums, t_h, t_w) ** 2).sum(2) / count
+        )
+        valid = variance > 1e-3 * count
+        result = np.zeros(variance.shape, np.float32)
+        result[valid] = correlation[valid] / np.sqrt(variance[valid] * norm)
+        return np.clip(result, -1.0, 1.0)
+
+
+def select_engine(image, template, method, engine="auto") -> str:
+    """
+    Chooses how a template is correlated with an image: "fft" when it covers
+    at least FFT_RATIO of the image area, "spatial" (cv2.matchTemplate)
+    otherwise. Only cv2.TM_CCOEFF_NORMED can be computed with FFTs.
+    :param image: the larger image
+    :param template: the template image
+    :param method: cv2.matchTemplate method
+    :param engine: "auto", "fft" or "spatial"
+    :return: "fft" or "spatial"
+    """
+    if engine not in ("auto", "fft", "spatial"):
+        raise Exception(f"Unknown correlation engine {engine}")
+    if engine == "fft" and method != cv2.TM_CCOEFF_NORMED:
+        raise Exception("FFT correlation only supports TM_CCOEFF_NORMED")
+    if engine != "auto":
+        return engine
+    ratio = (template.shape[0] * template.shape[1]) / float(
+        image.shape[0] * image.shape[1]
+    )
+    if method == cv2.TM_CCOEFF_NORMED and ratio >= FFT_RATIO:
+        return "fft"
+    return "spatial"
+
+
+def pyramid_depth(template, max_levels=2, min_size=40):
+    """
+    Number of times the template can be downsampled while keeping enough
+    detail to be matched. Smaller templates lose their details and their
+    best match gets lost among the peaks of the rest of the screen
+    :param template: template image
+    :param max_levels: maximum pyramid level allowed
+    :param min_size: minimum size in pixels of the downsampled template
+    :return: int
+    """
+    depth = 0
+    smallest = min(template.shape[:2])
+    while depth < max_levels and smallest // 2 ** (depth + 1) >= min_size:
+        depth += 1
+    return depth
+
+
+def orb_features(image, count):
+    """
+    ORB keypoints and descriptors of an image
+    :param image: numpy array, grayscale or BGR
+    :param count: maximum number of keypoints
+    :return: (keypoints, descriptors) tuple, descriptors are None when no
+    keypoint is found
+    """
+    if len(image.shape) == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.ORB_create(nfeatures=count).detectAndCompute(image, None)
+
+
+def feature_match(
+    pyramid: ImagePyramid,
+    template,
+    min_scale=0.3,
+    max_scale=2.0,
+    method=cv2.TM_CCOEFF_NORMED,
+    min_matches=10,
+) -> ImageMatch:
+    """
+    Scale invariant match: ORB keypoints of the template are matched with the
+    ones of the image, and a homography fitted with RANSAC gives the scale and
+    location of the template in a single pass. The location is then scored
+    with one cv2.matchTemplate call at that scale, so the score can be
+    compared against the same thresholds as the sweep.
+    :param pyramid: pyramid of the image, keeps the keypoints of the image
+    :param template: TemplateEntry
+    :param min_scale: the minimum scale of the image
+    :param max_scale: the maximum scale of the image
+    :param method: normalized cv2.matchTemplate method
+    :param min_matches: minimum number of matched keypoints to trust the
+    homography
+    :return: ImageMatch, with score 0 if the template can't be located
+    """
+    (t_keypoints, t_descriptors) = template.features
+    (i_keypoints, i_descriptors) = pyramid.features()
+    if (
+        t_descriptors is None
+        or i_descriptors is None
+        or len(t_keypoints) < min_matches
+    ):
+        return ImageMatch()
+    pairs = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(
+        t_descriptors, i_descriptors, k=2
+    )
+    # Lowe's ratio test
+    good = [
+        pair[0]
+        for pair in pairs
+        if len(pair) == 2 and pair[0].distance < 0.75 * pair[1].distance
+    ]
+    if len(good) < min_matches:
+        return ImageMatch()
+    source = np.float32([t_keypoints[m.queryIdx].pt for m in good])
+    destination = np.float32([i_keypoints[m.trainIdx].pt for m in good])
+    homography, _ = cv2.findHomography(
+        source.reshape(-1, 1, 2),
+        destination.reshape(-1, 1, 2),
+        cv2.RANSAC,
+        5.0,
+    )
+    if homography is None:
+        return ImageMatch()
+    (t_h, t_w) = template.image.shape[:2]
+    corners = cv2.perspectiveTransform(
+        np.float32([[0, 0], [t_w, 0], [t_w, t_h], [0, t_h]]).reshape(-1, 1, 2),
+        homography,
+    ).reshape(-1, 2)
+    (start_x, start_y) = corners.min(axis=0)
+    (end_x, end_y) = corners.max(axis=0)
+    if end_x - start_x < 1 or end_y - start_y < 1:
+        return ImageMatch()
+    scale = (t_w / (end_x - start_x) + t_h / (end_y - start_y)) / 2
+    if scale < min_scale or scale > max_scale:
+        return ImageMatch()
+    image = pyramid.image
+    pad = int(4 / scale) + 1
+    start_x = min(max(int(start_x) - pad, 0), image.shape[1])
+    start_y = min(max(int(start_y) - pad, 0), image.shape[0])
+    end_x = min(int(end_x) + pad + 1, image.shape[1])
+    end_y = min(int(end_y) + pad + 1, image.shape[0])
+    window = image[start_y:end_y, start_x:end_x]
+    width = int(window.shape[1] * scale)
+    height = int(window.shape[0] * scale)
+    if width < t_w or height < t_h:
+        return ImageMatch()
+    resized = cv2.resize(window, (width, height), interpolation=cv2.INTER_AREA)
+    result = cv2.matchTemplate(resized, template.image, method)
+    (score, location) = best_score(result, method)
+    match = __to_match(score, location, scale, t_w, t_h)
+    match.x += start_x
+    match.y += start_y
+    return match
+
+
+class TemplateEntry:
+    """
+    Decoded template together with the preprocessed variants used by the
+    matchers. Variants are computed on first use and kept with the entry.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.depth = pyramid_depth(image)
+        self.__levels = [image]
+        self.__variants = {}
+        self.__features = None
+        self.__lock = threading.Lock()
+
+    def variant(self, profile: MatchProfile, factor: float):
+        """
+        Template converted to the channels of the profile and resized by
+        factor, see MatchProfile.prepare
+        :param profile: MatchProfile
+        :param factor: factor applied to the resolution of the template
+        :return: TemplateEntry
+        """
+        if not profile.gray and factor == 1.0:
+            return self
+        key = (profile.gray, factor)
+        with self.__lock:
+            if key not in self.__variants:
+                self.__variants[key] = TemplateEntry(
+                    profile.prepare(self.image, factor)
+                )
+            return self.__variants[key]
+
+    @property
+    def features(self):
+        """
+        ORB keypoints and descriptors of the template
+        :return: (keypoints, descriptors) tuple
+        """
+        with self.__lock:
+            if self.__features is None:
+                self.__features = orb_features(self.image, 1000)
+            return self.__features
+
+    def level(self, number: int):
+        """
+        Returns the template downsampled `number` times with cv2.pyrDown, to
+        be matched against the same level of an ImagePyramid
+        :param number: pyramid level, 0 being the original template
+        :return: numpy array
+        """
+        levels = self.__levels
+        while len(levels) <= number:
+            levels = levels + [cv2.pyrDown(levels[-1])]
+        self.__levels = levels
+        return levels[number]
+
+
+class TemplateCache:
+    """
+    LRU cache of the templates read from disk, keyed by path and modification
+    time, so a template edited on disk is read again.
+    """
+
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, path: str, stats: MatchStats = None) -> TemplateEntry:
+        """
+        Returns the cached template for the path, reading it if it is not
+        cached or it changed on disk
+        :param path: path to the template
+        :param stats: MatchStats where the cache hit or miss is recorded
+        :return: TemplateEntry
+        """
+        key = os.path.abspath(path)
+        mtime = os.path.getmtime(key)
+        with self.__lock:
+            cached = self.__entries.get(key)
+            hit = cached is not None and cached[0] == mtime
+            if stats is not None:
+                stats.cache["template"] = hit
+            if hit:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+        image = cv2.imread(key)
+        if image is None:
+            raise Exception(f"There is no image in {path}")
+        entry = TemplateEntry(image)
+        with self.__lock:
+            self.misses += 1
+            self.__entries[key] = (mtime, entry)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def stats(self) -> dict:
+        """
+        Counters of the cache, e.g. to be sent to a dashboard
+        :return: dict with hits, misses, evictions, size and max_size
+        """
+        with self.__lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.__entries),
+                "max_size": self.max_size,
+            }
+
+    def clear(self):
+        """
+        Removes all the templates and resets the counters
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+template_cache = TemplateCache()
+
+
+class ScaleMemo:
+    """
+    Remembers the scale at which each reference image was last found on each
+    device and screen size, so the next search can start around it. It can be
+    saved to and loaded from a JSON file to carry it across sessions.
+    """
+
+    def __init__(self):
+        self.__scales = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def key(template_path: str, device, image) -> str:
+        """
+        Key of a reference image on a device and screen size
+        :param template_path: path to the reference image
+        :param device: device udid or name
+        :param image: numpy array of the screen
+        :return: str
+        """
+        return (
+            f"{os.path.abspath(template_path)}|{device}|"
+            f"{image.shape[1]}x{image.shape[0]}"
+        )
+
+    def get(self, key: str):
+        """
+        :param key: key returned by ScaleMemo.key
+        :return: the remembered scale, None if there isn't any
+        """
+        with self.__lock:
+            return self.__scales.get(key)
+
+    def remember(self, key: str, scale: float):
+        """
+        :param key: key returned by ScaleMemo.key
+        :param scale: scale at which the reference image was found
+        """
+        with self.__lock:
+            self.__scales[key] = round(float(scale), 4)
+
+    def forget(self, key: str):
+        """
+        :param key: key returned by ScaleMemo.key
+        """
+        with self.__lock:
+            self.__scales.pop(key, None)
+
+    def clear(self):
+        """
+        Forgets all the remembered scales
+        """
+        with self.__lock:
+            self.__scales.clear()
+
+    def load(self, path: str):
+        """
+        Adds the scales saved in a JSON file, if it exists. Scales already
+        remembered are kept.
+        :param path: path to the JSON file
+        """
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as file:
+            scales = json.load(file)
+        with self.__lock:
+            for key, scale in scales.items():
+                self.__scales.setdefault(key, scale)
+
+    def save(self, path: str):
+        """
+        Saves the remembered scales to a JSON file, merged with the ones
+        already saved in it
+        :param path: path to the JSON file
+        """
+        scales = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                scales = json.load(file)
+        with self.__lock:
+            scales.update(self.__scales)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(scales, file, indent=1, sort_keys=True)
+        os.replace(temporary, path)
+
+
+scale_memo = ScaleMemo()
+
+
+def screen_hash(image) -> str:
+    """
+    Digest of the pixels of an image. Any change of the screen, even a
+    single icon swapped for another of the same size, changes the digest.
+    :param image: numpy array
+    :return: hex string, prefixed with the size of the image
+    """
+    digest = hashlib.blake2b(
+        np.ascontiguousarray(image).data, digest_size=16
+    ).hexdigest()
+    return f"{image.shape[1]}x{image.shape[0]}:{digest}"
+
+
+class ResultCache:
+    """
+    LRU cache of match results keyed by the digest of the screen, the
+    template and the search options, so searching again in an unchanged
+    screen returns the previous result without matching again.
+    """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__results = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: key of the search
+        :return: copy of the cached ImageMatch, None if there isn't any
+        """
+        with self.__lock:
+            match = self.__results.get(key)
+            if match is None:
+                self.misses += 1
+                return None
+            self.__results.move_to_end(key)
+            self.hits += 1
+            return copy.copy(match)
+
+    def put(self, key, match: ImageMatch):
+        """
+        :param key: key of the search
+        :param match: ImageMatch found
+        """
+        with self.__lock:
+            self.__results[key] = copy.copy(match)
+            self.__results.move_to_end(key)
+            while len(self.__results) > self.max_size:
+                self.__results.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        Counters of the cache
+        :return: dict with hits, misses, size and max_size
+        """
+        with self.__lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.__results),
+                "max_size": self.max_size,
+            }
+
+    def clear(self):
+        """
+        Removes all the results and resets the counters
+        """
+        with self.__lock:
+            self.__results.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+result_cache = ResultCache()
+
+
+def pyramid_match(
+    image,
+    template,
+    threshold=0.9,
+    max_scale=2.0,
+    min_scale=0.3,
+    divisions=50,
+    candidates=3,
+    pyramid: ImagePyramid = None,
+    context: MatchContext = None,
+    method=cv2.TM_CCOEFF_NORMED,
+    engine="auto",
+    stats: MatchStats = None,
+) -> ImageMatch:
+    """
+    Coarse-to-fine multiscale template matching. All the scales are evaluated
+    on a downsampled level of the image pyramid, and only the best candidates
+    are refined at full resolution around the location where they were found.
+    When none of them goes over the threshold, every scale is swept again at
+    full resolution in grayscale and its best peaks are refined the same
+    way, so the coarse level never loses a match. Full
+    resolution work is split between worker threads sharing one
+    MatchContext, so concurrent calls never share any state.
+    :param image: the larger image
+    :param template: the template image, numpy array or TemplateEntry
+    :param threshold: the threshold of similarity
+    :param max_scale: the maximum scale of the image
+    :param min_scale: the minimum scale of the image
+    :param divisions: number of scales evaluated on the coarse level
+    :param candidates: number of coarse peaks refined at full resolution
+    :param pyramid: pyramid of the image, to reuse it between templates
+    :param context: MatchContext of the call, a new one by default
+    :param method: normalized cv2.matchTemplate method
+    :param engine: how the coarse level is correlated, see select_engine
+    :param stats: MatchStats where the evaluated scales are counted, only
+    used when no context is given
+    :return: ImageMatch with the best match found
+    """
+    if pyramid is None:
+        pyramid = ImagePyramid(image)
+    if context is None:
+        context = MatchContext(threshold, stats)
+    if not isinstance(template, TemplateEntry):
+        template = TemplateEntry(template)
+    depth = template.depth
+    coarse_template = template.level(depth)
+    template = template.image
+    scales = np.linspace(min_scale, max_scale, divisions)[::-1]
+    engine = select_engine(image, template, method, engine)
+
+    # the scales are split between the workers. If the template is too small
+    # to be downsampled the sweep is already done at full resolution, so
+    # every scale is a match on its own and there is nothing to refine.
+    peaks = [] if depth > 0 else None
+    for part in np.array_split(scales, MATCH_THREADS):
+        context.start(
+            __sweep,
+            pyramid,
+            depth,
+            (template, coarse_template),
+            part,
+            peaks,
+            (method, engine),
+        )
+    context.wait()
+    if depth == 0 or context.found:
+        return context.best
+
+    step = (max_scale - min_scale) / max(divisions - 1, 1)
+    # factor between the coarse level and the original image
+    factor = image.shape[1] / float(pyramid.level(depth).shape[1])
+    limits = (step, int(2 * factor) + 4, min_scale, max_scale)
+    __refine_peaks(
+        context, image, template, peaks, factor, limits, method, candidates
+    )
+    if context.wait().score > threshold:
+        return context.best
+
+    # the coarse level lost the template: every scale is swept again at
+    # full resolution. The sweep is done in grayscale, which is several
+    # times faster, and its best peaks are scored with all the channels.
+    logger.log_debug("Image not found from the coarse level, sweeping again")
+    gray = ImagePyramid(__grayscale(image))
+    gray_template = __grayscale(template)
+    peaks = []
+    for part in np.array_split(scales, MATCH_THREADS):
+        context.start(
+            __sweep,
+            gray,
+            0,
+            (gray_template, gray_template),
+            part,
+            peaks,
+            (method, "spatial"),
+        )
+    context.wait()
+    __refine_peaks(context, image, template, peaks, 1.0, limits, method)
+    return context.wait()
+
+
+def __grayscale(image):
+    """
+    :param image: numpy array, grayscale or BGR
+    :return: grayscale numpy array
+    """
+    if len(image.shape) == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def __refine_peaks(
+    context: MatchContext,
+    image,
+    template,
+    peaks: list,
+    factor,
+    limits,
+    method,
+    candidates=3,
+):
+    """
+    Starts a __refine_peak worker for each of the best peaks of a sweep
+    :param context: MatchContext of the call
+    :param image: the larger image
+    :param template: the template image
+    :param peaks: (score, scale, location) peaks of the sweep
+    :param factor: factor between the swept level and the original image
+    :param limits: (step, pad, min_scale, max_scale) tuple
+    :param method: normalized cv2.matchTemplate method
+    :param candidates: number of peaks refined
+    """
+    peaks.sort(key=lambda peak: peak[0], reverse=True)
+    for _, scale, location in peaks[:candidates]:
+        estimate = ImageMatch(
+            x=int(location[0] * factor / scale),
+            y=int(location[1] * factor / scale),
+            scale=scale,
+        )
+        context.start(__refine_peak, image, template, estimate, limits, method)
 
-    found_image = False
-    matched = 0.0
-    matching_list = []
 
-    root_dir = path
-    logger.log_debug(f"root directory: {root_dir}")
-    cap = cv2.VideoCapture(os.path.join(root_dir, video))
-    template = cv2.imread(os.path.join(root_dir, comparison))
-    if template is None:
-        logger.log_warn(
-            "trying to compare with an image that doesn't exist!"
-            f"{os.path.join(root_dir, comparison)}"
-        )
-        return False, 0.0
-    i = 0
-    percentage = 0.0
-    while cap.isOpened():
-        # Capture frame-by-frame
-        ret, frame = cap.read()
-        if ret and i % frame_rate_reduction == 0:
-            logger.log(f"frame evaluation = {i}")
-            found, percentage = __compare(
-                frame,
-                template,
-                threshold,
-                image_match,
-                root_dir,
-                max_scale,
-                0.1,
-                50,
+def __sweep(
+    context: MatchContext,
+    pyramid: ImagePyramid,
+    depth: int,
+    templates: tuple,
+    scales,
+    peaks: list,
+    methods: tuple,
+):
+    """
+    Worker matching the template against a pyramid level resized by each of
+    the given scales, in descending order. In the frequency domain the
+    template is resized instead, so the spectrum of the level is reused.
+    :param context: MatchContext of the call
+    :param pyramid: pyramid of the image
+    :param depth: pyramid level where the scales are evaluated
+    :param templates: the template image and the template downsampled to
+    the pyramid level
+    :param scales: scales to evaluate
+    :param peaks: list where the (score, scale, location) peaks are added,
+    None to submit every scale as a match instead
+    :param methods: normalized cv2.matchTemplate method and engine, see
+    select_engine
+    """
+    (method, engine) = methods
+    (template, coarse_template) = templates
+    (c_h, c_w) = coarse_template.shape[:2]
+    (t_h, t_w) = template.shape[:2]
+    for scale in scales:
+        if context.found:
+            return
+        if engine == "fft":
+            (max_val, max_loc) = __correlate(
+                pyramid, depth, coarse_template, scale
             )
-            if found:
-                cap.release()
-                logger.log(f"Match found in the {i}th frame of the video")
-                return True, percentage
-        elif not ret:
-            break
-        # sleep(frame_rate_reduction)
-        i += 1
-    cap.release()
-    return False, percentage
+            if max_loc is None:
+                return
+        else:
+            resized = pyramid.resized(depth, scale)
+            if resized.shape[0] < c_h or resized.shape[1] < c_w:
+                return
+            result = workspaces.current().match(
+                resized, coarse_template, method
+            )
+            (max_val, max_loc) = best_score(result, method)
+        context.evaluated()
+        if peaks is not None:
+            peaks.append((max_val, scale, max_loc))
+        elif context.submit(__to_match(max_val, max_loc, scale, t_w, t_h)):
+            return
+
+
+def __correlate(pyramid: ImagePyramid, depth: int, template, scale):
+    """
+    Correlates a pyramid level with the template resized by 1 / scale in
+    the frequency domain
+    :param pyramid: pyramid of the image
+    :param depth: pyramid level
+    :param template: the template downsampled to the pyramid level
+    :param scale: scale applied to the image
+    :return: (score, (x, y)) with the location in the level resized by
+    scale, (0, None) if the resized template doesn't fit in the level
+    """
+    correlator = pyramid.correlator(depth)
+    width = max(int(round(template.shape[1] / scale)), 1)
+    height = max(int(round(template.shape[0] / scale)), 1)
+    if height > correlator.shape[0] or width > correlator.shape[1]:
+        return 0, None
+    interpolation = cv2.INTER_AREA if scale > 1 else cv2.INTER_LINEAR
+    resized = cv2.resize(template, (width, height), interpolation=interpolation)
+    (score, location) = best_score(correlator.match(resized))
+    return score, (location[0] * scale, location[1] * scale)
+
+
+def __refine_peak(
+    context: MatchContext,
+    image,
+    template,
+    estimate: ImageMatch,
+    limits,
+    method,
+):
+    """
+    Worker refining a coarse peak: a first pass around the coarse scale and
+    a second pass around the best refined scale with a finer step
+    :param context: MatchContext of the call
+    :param image: the larger image
+    :param template: the template image
+    :param estimate: ImageMatch with the coarse location and scale
+    :param limits: (step, pad, min_scale, max_scale) tuple
+    :param method: normalized cv2.matchTemplate method
+    """
+    (step, pad, min_scale, max_scale) = limits
+    match = estimate
+    for span in (step, step / 4):
+        match = __refine(
+            context,
+            image,
+            template,
+            match,
+            span,
+            pad,
+            (min_scale, max_scale),
+            method,
+        )
+        if match is None or context.submit(match):
+            return
 
 
-def __compare(
+def __refine(
+    context: MatchContext,
     image,
     template,
-    threshold: float,
-    image_match: str,
-    root_dir: str,
-    max_scale: float,
-    min_scale=0.1,
-    divisions=25,
+    estimate: ImageMatch,
+    span,
+    pad,
+    limits,
+    method,
 ):
     """
-    Compare a template image to a larger image and return the percentage of
-    similarity
+    Evaluates the scales around an estimated match at full resolution, only
+    within a window around the location where it was estimated.
+    :param context: MatchContext of the call
     :param image: the larger image
     :param template: the template image
+    :param estimate: ImageMatch with the estimated location and scale
+    :param span: distance to the furthest scale evaluated
+    :param pad: extra pixels around the template size added to the window
+    :param limits: (min_scale, max_scale) tuple
+    :param method: normalized cv2.matchTemplate method
+    :return: ImageMatch with the best refined match, None if cancelled
+    """
+    (min_scale, max_scale) = limits
+    (t_h, t_w) = template.shape[:2]
+    workspace = workspaces.current()
+    best = estimate
+    for scale in np.linspace(estimate.scale - span, estimate.scale + span, 5):
+        if context.found:
+            return None
+        if scale < min_scale or scale > max_scale:
+            continue
+        # window in the coordinates of the original image
+        start_x = max(int(estimate.x - pad / scale), 0)
+        start_y = max(int(estimate.y - pad / scale), 0)
+        end_x = min(int(estimate.x + (t_w + pad) / scale) + 1, image.shape[1])
+        end_y = min(int(estimate.y + (t_h + pad) / scale) + 1, image.shape[0])
+        window = image[start_y:end_y, start_x:end_x]
+        width = int(window.shape[1] * scale)
+        height = int(window.shape[0] * scale)
+        if width < t_w or height < t_h:
+            continue
+        resized = workspace.resize("window", window, width, height)
+        result = workspace.match(resized, template, method)
+        (max_val, max_loc) = best_score(result, method)
+        context.evaluated()
+        if max_val > best.score or best.width == 0:
+            best = __to_match(max_val, max_loc, scale, t_w, t_h)
+            best.x += start_x
+            best.y += start_y
+    return best
+
+
+def __to_match(score, location, scale, width, height) -> ImageMatch:
+    """
+    Converts a location found in an image resized by `scale` to an ImageMatch
+    in the coordinates of the original image
+    :param score: match score
+    :param location: top left corner of the match in the resized image
+    :param scale: scale applied to the image
+    :param width: template width
+    :param height: template height
+    :return: ImageMatch
+    """
+    return ImageMatch(
+        float(score),
+        int(location[0] / scale),
+        int(location[1] / scale),
+        int(width / scale),
+        int(height / scale),
+        float(scale),
+    )
+
+
+def draw_rectangle(image, match: ImageMatch, image_path: str):
+    """
+    Saves a copy of the image with a rectangle around the match
+    :param image: the image where the match was found
+    :param match: ImageMatch
+    :param image_path: path where the image is saved
+    """
+    marked = image.copy()
+    cv2.rectangle(
+        marked,
+        (match.x, match.y),
+        (match.x + match.width, match.y + match.height),
+        (0, 0, 255),
+        2,
+    )
+    cv2.imwrite(image_path, marked)
+    logger.log(image_path)
+
+
+def image_from_bytes(data: bytes):
+    """
+    Decodes an encoded image (PNG, JPEG...) kept in memory
+    :param data: the encoded image, e.g. from driver.get_screenshot_as_png()
+    :return: numpy array in BGR format
+    """
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def thumbnail_from_bytes(data: bytes):
+    """
+    Decodes an encoded image in grayscale at a quarter of its resolution,
+    which is several times faster than decoding it fully
+    :param data: the encoded image, e.g. from driver.get_screenshot_as_png()
+    :return: numpy array in grayscale
+    """
+    return cv2.imdecode(
+        np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4
+    )
+
+
+def size_from_bytes(data: bytes):
+    """
+    Gets the size of an encoded image. PNG images are only read up to their
+    IHDR header, other formats are decoded.
+    :param data: the encoded image, at least its first 24 bytes for PNG
+    :return: The width and height of the image.
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR":
+        return (
+            int.from_bytes(data[16:20], "big"),
+            int.from_bytes(data[20:24], "big"),
+        )
+    height, width = image_from_bytes(data).shape[:2]
+    return width, height
+
+
+def load_image(image, root_dir=""):
+    """
+    Returns the image as a numpy array. Arrays are returned as they are, and
+    paths are read from disk, relative to root_dir when they don't exist.
+    :param image: numpy array or path to the image
+    :param root_dir: directory where relative paths are looked up
+    :return: numpy array in BGR format
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    return cv2.imread(__image_path(image, root_dir))
+
+
+def load_template(image, root_dir="", stats: MatchStats = None):
+    """
+    Returns the template to match. Paths go through the template cache, so
+    reference images are decoded and preprocessed only once.
+    :param image: numpy array or path to the image
+    :param root_dir: directory where relative paths are looked up
+    :param stats: MatchStats where the template cache hit is recorded
+    :return: TemplateEntry
+    """
+    if isinstance(image, np.ndarray):
+        return TemplateEntry(image)
+    return template_cache.get(__image_path(image, root_dir), stats)
+
+
+def __image_path(image: str, root_dir: str) -> str:
+    """
+    Resolves the path of an image, relative to root_dir when it doesn't exist
+    :param image: path to the image
+    :param root_dir: directory where relative paths are looked up
+    :return: str
+    """
+    path = image
+    if not os.path.exists(path):
+        path = os.path.join(root_dir, image)
+        if not os.path.exists(path):
+            raise Exception(f"There is no image in {path}")
+    return path
+
+
+def describe_image(image) -> str:
+    """
+    Text used in the logs to refer to an image
+    :param image: numpy array or path to the image
+    :return: str
+    """
+    if isinstance(image, np.ndarray):
+        return f"in-memory image {image.shape[1]}x{image.shape[0]}"
+    return str(image)
+
+
+def crop_region(image, region):
+    """
+    Crops the region of interest of an image. The region is either a
+    (x, y, width, height) rectangle or an element (anything with `location`
+    and `dimensions`, like Elements) whose bounds define the rectangle.
+    :param image: numpy array
+    :param region: rectangle, element or None for the whole image
+    :return: (cropped image, (x, y) offset of the crop in the image)
+    """
+    if region is None:
+        return image, (0, 0)
+    if hasattr(region, "location") and hasattr(region, "dimensions"):
+        location = region.location
+        dimensions = region.dimensions
+        region = (location.x, location.y, dimensions.x, dimensions.y)
+    (x, y, width, height) = (int(value) for value in region)
+    start_x = min(max(x, 0), image.shape[1])
+    start_y = min(max(y, 0), image.shape[0])
+    end_x = min(max(x + width, start_x), image.shape[1])
+    end_y = min(max(y + height, start_y), image.shape[0])
+    return image[start_y:end_y, start_x:end_x], (start_x, start_y)
+
+
+def match_region(
+    image,
+    template,
+    threshold,
+    max_scale,
+    min_scale,
+    divisions,
+    region,
+    pyramids: dict = None,
+    profile=None,
+    stats: MatchStats = None,
+) -> ImageMatch:
+    """
+    Matches the template only within the region of interest of the image,
+    returning the match in the coordinates of the whole image
+    :param image: the larger image
+    :param template: the template image, numpy array or TemplateEntry
     :param threshold: the threshold of similarity
-    :param image_match: the image to save if a match is found
-    :param root_dir: the root directory of the project
     :param max_scale: the maximum scale of the image
     :param min_scale: the minimum scale of the image
-    :return: True if a match is found, False otherwise
+    :param divisions: number of scales evaluated
+    :param region: rectangle, element or None, see crop_region
+    :param pyramids: dict where the pyramids of the cropped image are kept
+    by resolution factor, to reuse them between templates
+    :param profile: MatchProfile or its name, see match_profile
+    :param stats: MatchStats where the evaluated scales are counted
+    :return: ImageMatch
     """
-    (tH, tW) = template.shape[:2]
-    # loop over the scales of the image
-    found = None
-    global found_image
-    global matched
-    global matching_list
-    max_val = 0.0
-    for scale in np.linspace(min_scale, max_scale, divisions)[::-1]:
-        # resize the image according to the scale, and keep track of the ratio
-        # of the resizing.
-        resized = imutils.resize(image, width=int(image.shape[1] * scale))
-        r = image.shape[1] / float(resized.shape[1])
-        # if the resized image is smaller than the template, then break from
-        # the loop
-        if resized.shape[0] < tH or resized.shape[1] < tW:
-            break
-        result = cv2.matchTemplate(resized, template, cv2.TM_CCOEFF_NORMED)
-        (_, max_val, _, max_loc) = cv2.minMaxLoc(result)
-        # if we have found a new maximum correlation value, then update the
-        # bookkeeping variable
-        if found is None or max_val > found[0]:
-            lock = threading.Lock()
-            lock.acquire()
-            if found_image:
-                lock.release()
-                return True, matched
-            matching_list.append(max_val)
-            lock.release()
-            found = (max_val, max_loc, r)
-            if max_val > threshold:
-                if image_match != "" and found is not None:
-                    # unpack the bookkeeping variable and compute the (x, y)
-                    # coordinates of the bounding box based on the resized ratio
-                    (_, max_loc, r) = found
-                    (start_x, start_y) = (
-                        int(max_loc[0] * r),
-                        int(max_loc[1] * r),
-                    )
-                    (end_x, end_y) = (
-                        int((max_loc[0] + tW) * r),
-                        int((max_loc[1] + tH) * r),
-                    )
-                    # draw a bounding box around the detected result and display
-                    # the image
-                    cv2.rectangle(
-                        image,
-                        (start_x, start_y),
-                        (end_x, end_y),
-                        (0, 0, 255),
-                        2,
-                    )
-                    cv2.imwrite(os.path.join(root_dir, image_match), image)
-                    logger.log(os.path.join(root_dir, image_match))
-                lock.acquire()
-                found_image = True
-                lock.release()
-                matched = max_val
-                return True, max_val
-    matched = max(matching_list)
-    return False, matched
+    profile = match_profile(profile)
+    if not isinstance(template, TemplateEntry):
+        template = TemplateEntry(template)
+    cropped, (offset_x, offset_y) = crop_region(image, region)
+    if cropped.shape[0] == 0 or cropped.shape[1] == 0:
+        return ImageMatch()
+    factor = profile.factor_for(template.image)
+    if pyramids is None:
+        pyramids = {}
+    if factor not in pyramids:
+        pyramids[factor] = ImagePyramid(profile.prepare(cropped, factor))
+    pyramid = pyramids[factor]
+    template = template.variant(profile, factor)
+    match = ImageMatch()
+    if profile.features:
+        match = feature_match(
+            pyramid, template, min_scale, max_scale, profile.method
+        )
+        if match.score <= threshold:
+            logger.log_debug("Image not found by its keypoints")
+    if match.score <= threshold:
+        match = pyramid_match(
+            pyramid.image,
+            template,
+            threshold,
+            max_scale,
+            min_scale,
+            divisions,
+            pyramid=pyramid,
+            method=profile.method,
+            stats=stats,
+        )
+    match.x = int(match.x / factor) + offset_x
+    match.y = int(match.y / factor) + offset_y
+    match.width = int(match.width / factor)
+    match.height = int(match.height / factor)
+    return match
+
+
+def memo_match(
+    image,
+    template,
+    threshold,
+    max_scale,
+    min_scale,
+    divisions,
+    region,
+    memo_key=None,
+    pyramids: dict = None,
+    profile=None,
+    result_key=None,
+    stats: MatchStats = None,
+) -> ImageMatch:
+    """
+    Like match_region, but when a scale is remembered for memo_key only the
+    scales around it are evaluated first, and the whole range is only swept
+    when the reference image is not found there. The scale of a match is
+    remembered for the next call.
+    :param image: the larger image
+    :param template: the template image, numpy array or TemplateEntry
+    :param threshold: the threshold of similarity
+    :param max_scale: the maximum scale of the image
+    :param min_scale: the minimum scale of the image
+    :param divisions: number of scales evaluated
+    :param region: rectangle, element or None, see crop_region
+    :param memo_key: key in scale_memo, see ScaleMemo.key. None to not use it
+    :param pyramids: pyramids of the cropped image, see match_region
+    :param profile: MatchProfile or its name, see match_profile
+    :param result_key: key in result_cache, see __result_key. None to not
+    use it
+    :param stats: MatchStats where the evaluated scales and the cache hits
+    are recorded
+    :return: ImageMatch
+    """
+    if result_key is not None:
+        match = result_cache.get(result_key)
+        if stats is not None:
+            stats.cache["result"] = match is not None
+        if match is not None:
+            logger.log_debug("Screen didn't change, reusing image match")
+            return match
+    if pyramids is None:
+        pyramids = {}
+    scale = None if memo_key is None else scale_memo.get(memo_key)
+    if scale is not None:
+        match = match_region(
+            image,
+            template,
+            threshold,
+            scale * 1.1,
+            scale * 0.9,
+            5,
+            region,
+            pyramids,
+            profile,
+            stats,
+        )
+        if stats is not None:
+            stats.cache["scale_memo"] = match.score > threshold
+        if match.score <= threshold:
+            logger.log_debug(f"Image not found at remembered scale {scale}")
+    if scale is None or match.score <= threshold:
+        match = match_region(
+            image,
+            template,
+            threshold,
+            max_scale,
+            min_scale,
+            divisions,
+            region,
+            pyramids,
+            profile,
+            stats,
+        )
+        if memo_key is not None and match.score > threshold:
+            scale_memo.remember(memo_key, match.scale)
+    if result_key is not None:
+        result_cache.put(result_key, match)
+    return match
+
+
+def __memo_key(image, comparison, root_dir, device):
+    """
+    Key of the reference image in scale_memo, None if it can't be remembered
+    :param image: numpy array of the screen
+    :param comparison: path or numpy array of the reference image
+    :param root_dir: directory where relative paths are looked up
+    :param device: device udid or name, None to not use the memo
+    :return: str or None
+    """
+    if device is None or isinstance(comparison, np.ndarray):
+        return None
+    return ScaleMemo.key(__image_path(comparison, root_dir), device, image)
+
+
+def __result_key(image, comparison, root_dir, options):
+    """
+    Key of a search in result_cache, None if it can't be cached: templates
+    given as arrays and regions given as elements, which can move, are not
+    :param image: numpy array of the screen
+    :param comparison: path or numpy array of the reference image
+    :param root_dir: directory where relative paths are looked up
+    :param options: tuple with the rest of the options of the search, None
+    to not use the cache
+    :return: tuple or None
+    """
+    if options is None or isinstance(comparison, np.ndarray):
+        return None
+    if any(hasattr(option, "location") for option in options):
+        return None
+    path = os.path.abspath(__image_path(comparison, root_dir))
+    return screen_hash(image), path, os.path.getmtime(path), repr(options)
 
 
 def compare_images(
-    original: str,
-    comparison: str,
+    original,
+    comparison,
     threshold=0.9,
     image_match="",
     max_scale=2.0,
     min_scale=0.3,
     path="",
+    region=None,
+    device=None,
+    profile=None,
+    cache=False,
 ):
     """
     Compare two images and return a boolean if they are similar or not
-    :param original: The original image
-    :param comparison: The image to compare
+    :param original: The original image, path or numpy array
+    :param comparison: The image to compare, path or numpy array
     :param threshold: The threshold to compare the images
     :param image_match: The image to save the match
     :param max_scale: The maximum scale to compare the images
     :param min_scale: The minimum scale to compare the images
+    :param region: Region of interest of the original image, see crop_region
+    :param device: device udid or name to remember the scale of the match
+    for, see memo_match. None to always sweep all the scales
+    :param profile: name of the MatchProfile, see match_profile
+    :param cache: reuse the result of the same search in the same screen,
+    see screen_hash
     :return: A boolean if the images are similar or not
     """
-    # Read the images from the file
-    global found_image
-    global matched
-    global matching_list
-
     start = time.time()
-    matched = 0.0
-    matching_list = []
-    found_image = False
     root_dir = path
-    if not os.path.exists(comparison):
-        comparison = os.path.join(root_dir, comparison)
-        if not os.path.exists(comparison):
-            raise Exception(f"There is no image in {comparison}")
-    if not os.path.exists(original):
-        original = os.path.join(root_dir, original)
-        if not os.path.exists(original):
-            raise Exception(f"There is no image in {original}")
-    template = cv2.imread(comparison)
-    image = cv2.imread(original)
-    # loop over the scales of the image
-    threads = []
-    parts = max_scale / 5.0
-    min_scale = min(min_scale, parts)
-
-    threads.append(
-        threading.Thread(
-            target=__compare,
-            args=(
-                image,
-                template,
-                threshold,
-                image_match,
-                root_dir,
-                parts,
-                min_scale,
-            ),
-        )
+    stats = MatchStats("compare_images", threshold, profile)
+    template = load_template(comparison, root_dir, stats)
+    image = load_image(original, root_dir)
+    stats.describe(comparison, image, template)
+    options = (threshold, max_scale, min_scale, region, profile)
+    match = memo_match(
+        image,
+        template,
+        threshold,
+        max_scale,
+        min(min_scale, max_scale / 5.0),
+        50,
+        region,
+        __memo_key(image, comparison, root_dir, device),
+        profile=profile,
+        result_key=__result_key(
+            image, comparison, root_dir, options if cache else None
+        ),
+        stats=stats,
     )
-    threads.append(
-        threading.Thread(
-            target=__compare,
-            args=(
-                image,
-                template,
-                threshold,
-                image_match,
-                root_dir,
-                parts * 2.0,
-                parts,
-            ),
-        )
-    )
-    threads.append(
-        threading.Thread(
-            target=__compare,
-            args=(
-                image,
-                template,
-                threshold,
-                image_match,
-                root_dir,
-                parts * 3.0,
-                parts * 2.0,
-            ),
-        )
-    )
-    threads.append(
-        threading.Thread(
-            target=__compare,
-            args=(
-                image,
-                template,
-                threshold,
-                image_match,
-                root_dir,
-                parts * 4.0,
-                parts * 3.0,
-            ),
-        )
-    )
-    threads.append(
-        threading.Thread(
-            target=__compare,
-            args=(
-                image,
-                template,
-                threshold,
-                image_match,
-                root_dir,
-                parts * 5.0,
-                parts * 4.0,
-            ),
+    found = match.score > threshold
+    if found and image_match != "":
+        draw_rectangle(image, match, os.path.join(root_dir, image_match))
+
+    stats.finish(match, start)
+    telemetry.emit(stats)
+    logger.log(f"Image recognition took {stats.duration}s")
+    return found, match.score
+
+
+def compare_images_batch(
+    original,
+    comparisons,
+    threshold=0.9,
+    max_scale=2.0,
+    min_scale=0.3,
+    path="",
+    region=None,
+    device=None,
+    profile=None,
+    cache=False,
+) -> dict:
+    """
+    Searches several images within the same original image. The original
+    image is loaded, cropped and downsampled only once, and the resized
+    levels of its pyramid are shared by all the searches.
+    :param original: The original image, path or numpy array
+    :param comparisons: List of paths of the images to search for
+    :param threshold: The threshold to compare the images
+    :param max_scale: The maximum scale to compare the images
+    :param min_scale: The minimum scale to compare the images
+    :param path: directory where relative paths are looked up
+    :param region: Region of interest of the original image, see crop_region
+    :param device: device udid or name to remember the scale of the matches
+    for, see memo_match. None to always sweep all the scales
+    :param profile: name of the MatchProfile, see match_profile
+    :param cache: reuse the result of the same search in the same screen,
+    see screen_hash
+    :return: dict with a {"found", "score", "center"} dict for each path
+    """
+    start = time.time()
+    image = load_image(original, path)
+    options = (threshold, max_scale, min_scale, region, profile)
+    pyramids = {}
+    results = {}
+    for comparison in comparisons:
+        searched = time.time()
+        stats = MatchStats("compare_images_batch", threshold, profile)
+        template = load_template(comparison, path, stats)
+        stats.describe(comparison, image, template)
+        match = memo_match(
+            image,
+            template,
+            threshold,
+            max_scale,
+            min(min_scale, max_scale / 5.0),
+            50,
+            region,
+            __memo_key(image, comparison, path, device),
+            pyramids,
+            profile,
+            __result_key(image, comparison, path, options if cache else None),
+            stats,
         )
-    )
-    for thread in threads:
-        thread.start()
-    while not found_image:
-        alive = False
-        for thread in threads:
-            if thread.is_alive():
-                alive = True
-        if not alive:
-            break
+        stats.finish(match, searched)
+        telemetry.emit(stats)
+        results[comparison] = {
+            "found": match.score > threshold,
+            "score": match.score,
+            "center": match.center,
+        }
 
-    logger.log(f"Image recognition took {time.time() - start}s")
-    return found_image, max(matching_list)
+    logger.log(
+        f"Image recognition of {len(comparisons)} images took "
+        f"{time.time() - start}s"
+    )
+    return results
 
 
 def get_point_match(
-    original: str, comparison: str, threshold=0.9, device_name="Device"
+    original,
+    comparison,
+    threshold=0.9,
+    device_name="Device",
+    region=None,
+    device=None,
+    profile=None,
+    cache=False,
 ):
     """
-    Get the point where the images match. If the images don't match, return None
-    :param original: The original image
-    :param comparison: The image to compare to
+    Get the point where the images match. If the images don't match, return
+    the point with the highest similarity
+    :param original: The original image, path or numpy array
+    :param comparison: The image to compare to, path or numpy array
     :param threshold: The threshold to match the images
     :param device_name: The device name
+    :param region: Region of interest of the original image, see crop_region
+    :param device: device udid or name to remember the scale of the match
+    for, see memo_match. None to always sweep all the scales
+    :param profile: name of the MatchProfile, see match_profile
+    :param cache: reuse the result of the same search in the same screen,
+    see screen_hash
     :return: The point where the images match
     """
     _ = device_name
 
-    # Read the images from the file
-    template = cv2.imread(comparison)
-    (tH, tW) = template.shape[:2]
-    image = cv2.imread(original)
-    found = None
-    # loop over the scales of the image
-    for scale in np.linspace(0.2, 2.0, 30)[::-1]:
-        # resize the image according to the scale, and keep track of the ratio
-        # of the resizing
-        resized = imutils.resize(image, width=int(image.shape[1] * scale))
-        r = image.shape[1] / float(resized.shape[1])
-        # if the resized image is smaller than the template, then break from
-        # the loop
-        if resized.shape[0] < tH or resized.shape[1] < tW:
-            break
-        result = cv2.matchTemplate(resized, template, cv2.TM_CCOEFF_NORMED)
-        (_, max_val, _, max_loc) = cv2.minMaxLoc(result)
-        # if we have found a new maximum correlation value, then update the
-        # bookkeeping variable
-        if found is None or max_val > found[0]:
-            found = (max_val, max_loc, r)
-            if max_val > threshold:
-                break
+    return get_match(
+        original, comparison, threshold, region, device, profile, cache
+    ).center
+
+
+def get_match(
+    original,
+    comparison,
+    threshold=0.9,
+    region=None,
+    device=None,
+    profile=None,
+    cache=False,
+) -> ImageMatch:
+    """
+    Get the best match of the image, with its score. The search stops at the
+    first scale where the image is found.
+    :param original: The original image, path or numpy array
+    :param comparison: The image to compare to, path or numpy array
+    :param threshold: The threshold to match the images
+    :param region: Region of interest of the original image, see crop_region
+    :param device: device udid or name to remember the scale of the match
+    for, see memo_match. None to always sweep all the scales
+    :param profile: name of the MatchProfile, see match_profile
+    :param cache: reuse the result of the same search in the same screen,
+    see screen_hash
+    :return: ImageMatch, the one with the highest similarity if the images
+    don't match
+    """
+    start = time.time()
+    stats = MatchStats("get_match", threshold, profile)
+    template = load_template(comparison, stats=stats)
+    image = load_image(original)
+    stats.describe(comparison, image, template)
+    options = (threshold, 2.0, 0.2, region, profile)
+    match = memo_match(
+        image,
+        template,
+        threshold,
+        2.0,
+        0.2,
+        30,
+        region,
+        __memo_key(image, comparison, "", device),
+        profile=profile,
+        result_key=__result_key(
+            image, comparison, "", options if cache else None
+        ),
+        stats=stats,
+    )
+    stats.finish(match, start)
+    telemetry.emit(stats)
+
+    return match
+
+
+def find_matches(
+    image,
+    template,
+    threshold=0.9,
+    max_scale=2.0,
+    min_scale=0.3,
+    region=None,
+    profile=None,
+    overlap=0.3,
+    stats: MatchStats = None,
+) -> list:
+    """
+    Finds all the occurrences of the template. The scale of the best match is
+    found first, and the image is then matched once per scale around it: all
+    the local maxima over the threshold are kept and overlapping ones are
+    removed with non-maximum suppression.
+    :param image: the larger image, numpy array
+    :param template: the template image, numpy array or TemplateEntry
+    :param threshold: the threshold of similarity
+    :param max_scale: the maximum scale of the image
+    :param min_scale: the minimum scale of the image
+    :param region: rectangle, element or None, see crop_region
+    :param profile: MatchProfile or its name, see match_profile
+    :param overlap: maximum intersection over union of two occurrences
+    :param stats: MatchStats of the search, sent to the telemetry hooks once
+    it ends. A new one is used when None
+    :return: list of ImageMatch in reading order, top to bottom and left to
+    right
+    """
+    start = time.time()
+    if stats is None:
+        stats = MatchStats("find_matches", threshold, profile)
+    profile = match_profile(profile)
+    if not isinstance(template, TemplateEntry):
+        template = TemplateEntry(template)
+    if stats.image_size is None:
+        stats.describe(template.image, image, template)
+    best = match_region(
+        image,
+        template,
+        threshold,
+        max_scale,
+        min_scale,
+        50,
+        region,
+        profile=profile,
+        stats=stats,
+    )
+    matches = []
+    if best.score > threshold:
+        matches = __occurrences(
+            image, template, best, threshold, region, profile, overlap
+        )
+    stats.finish(best, start)
+    telemetry.emit(stats)
+    return matches
+
+
+def __occurrences(image, template, best, threshold, region, profile, overlap):
+    """
+    All the occurrences of the template at the scales around the best match,
+    see find_matches
+    :param image: the larger image, numpy array
+    :param template: TemplateEntry
+    :param best: best ImageMatch, over the threshold
+    :param threshold: the threshold of similarity
+    :param region: rectangle, element or None, see crop_region
+    :param profile: MatchProfile
+    :param overlap: maximum intersection over union of two occurrences
+    :return: list of ImageMatch in reading order
+    """
+    cropped, (offset_x, offset_y) = crop_region(image, region)
+    factor = profile.factor_for(template.image)
+    prepared = profile.prepare(cropped, factor)
+    variant = template.variant(profile, factor).image
+    (t_h, t_w) = variant.shape[:2]
+    kernel = np.ones((max(t_h // 2, 1), max(t_w // 2, 1)), np.uint8)
+    workspace = workspaces.current()
+    boxes = []
+    scores = []
+    for scale in (best.scale * 0.98, best.scale, best.scale * 1.02):
+        width = int(prepared.shape[1] * scale)
+        height = int(prepared.shape[0] * scale)
+        if width < t_w or height < t_h:
+            continue
+        resized = workspace.resize("level", prepared, width, height)
+        result = workspace.match(resized, variant, profile.method)
+        if profile.method == cv2.TM_SQDIFF_NORMED:
+            result = 1.0 - result
+        # local maxima over the threshold, instead of every pixel over it
+        peaks = (result >= cv2.dilate(result, kernel)) & (result > threshold)
+        (ys, xs) = np.nonzero(peaks)
+        scores.append(result[ys, xs])
+        boxes.append(
+            np.stack(
+                [
+                    xs / scale,
+                    ys / scale,
+                    np.full(len(xs), t_w / scale),
+                    np.full(len(xs), t_h / scale),
+                ],
+                axis=1,
+            )
+        )
+    if not boxes:
+        return [best]
+    boxes = np.concatenate(boxes) / factor
+    scores = np.concatenate(scores)
+    matches = [
+        ImageMatch(
+            float(scores[i]),
+            int(boxes[i, 0]) + offset_x,
+            int(boxes[i, 1]) + offset_y,
+            int(boxes[i, 2]),
+            int(boxes[i, 3]),
+            best.scale,
+        )
+        for i in non_max_suppression(boxes, scores, overlap)
+    ]
+    return reading_order(matches) if matches else [best]
+
+
+def non_max_suppression(boxes, scores, overlap=0.3) -> list:
+    """
+    Greedy non-maximum suppression: boxes overlapping a better scored box by
+    more than `overlap` intersection over union are discarded
+    :param boxes: numpy array of (x, y, width, height) rows
+    :param scores: numpy array with the score of each box
+    :param overlap: maximum intersection over union
+    :return: list of the indexes of the boxes kept, best first
+    """
+    start_x, start_y = boxes[:, 0], boxes[:, 1]
+    end_x = boxes[:, 0] + boxes[:, 2]
+    end_y = boxes[:, 1] + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+    order = np.argsort(scores)[::-1]
+    kept = []
+    while order.size > 0:
+        current = order[0]
+        kept.append(int(current))
+        rest = order[1:]
+        width = np.maximum(
+            np.minimum(end_x[current], end_x[rest])
+            - np.maximum(start_x[current], start_x[rest]),
+            0,
+        )
+        height = np.maximum(
+            np.minimum(end_y[current], end_y[rest])
+            - np.maximum(start_y[current], start_y[rest]),
+            0,
+        )
+        intersection = width * height
+        union = areas[current] + areas[rest] - intersection
+        order = rest[intersection / union <= overlap]
+    return kept
 
-    # unpack the bookkeeping variable and compute the (x, y) coordinates
-    # of the bounding box based on the resized ratio
-    (_, max_loc, r) = found
-    (start_x, start_y) = (int(max_loc[0] * r), int(max_loc[1] * r))
-    (end_x, end_y) = (int((max_loc[0] + tW) * r), int((max_loc[1] + tH) * r))
 
-    return start_x + (end_x - start_x) // 2, start_y + (end_y - start_y) // 2
+def reading_order(matches: list) -> list:
+    """
+    Sorts matches top to bottom and left to right. Matches whose vertical
+    centers are closer than half their height are in the same row.
+    :param matches: list of ImageMatch
+    :return: list of ImageMatch
+    """
+    rows = []
+    for match in sorted(matches, key=lambda item: item.center[1]):
+        if rows and abs(match.center[1] - rows[-1][0].center[1]) < max(
+            match.height // 2, 1
+        ):
+            rows[-1].append(match)
+        else:
+            rows.append([match])
+    return [
+        match
+        for row in rows
+        for match in sorted(row, key=lambda item: item.center[0])
+    ]
 
 
 def draw_match(
-    original: str, comparison: str, threshold=0.9, device_name="Device"
-):
+    original,
+    comparison,
+    threshold=0.9,
+    device_name="Device",
+    image_path="something.png",
+) -> list:
     """
-    Draws a rectangle around the match of the two images.
-    :param original: The original image
-    :param comparison: The image to compare to
+    Draws a rectangle around every occurrence of the comparison image in the
+    original image, see find_matches.
+    :param original: The original image, path or numpy array
+    :param comparison: The image to compare to, path or numpy array
     :param threshold: The threshold to match the images
     :param device_name: The device name
+    :param image_path: Where the image with the rectangles is saved
+    :return: list of ImageMatch
     """
-    method = cv2.TM_CCOEFF_NORMED
-
-    # Read the images from the file
-    large_image = cv2.imread(comparison)
-    small_image = cv2.imread(original)
-
     logger.log_debug(
-        f'{device_name}: Comparing "{original}" with "{comparison}"'
+        f"{device_name}: Comparing {describe_image(original)} with "
+        f"{describe_image(comparison)}"
     )
-    res = cv2.matchTemplate(small_image, large_image, method)
-
-    loc = np.where(res >= threshold)
-    _, w, h = large_image.shape[::-1]
-    # For each match...
-    suh = None
-    for pt in zip(*loc[::-1]):
-        suh = cv2.rectangle(
-            small_image, pt, (pt[0] + w, pt[1] + h), (0, 66, 255), 1
+    stats = MatchStats("draw_match", threshold)
+    template = load_template(comparison, stats=stats)
+    image = load_image(original)
+    stats.describe(comparison, image, template)
+    matches = find_matches(image, template, threshold, stats=stats)
+    drawn = image.copy()
+    for match in matches:
+        cv2.rectangle(
+            drawn,
+            (match.x, match.y),
+            (match.x + match.width, match.y + match.height),
+            (0, 66, 255),
+            1,
         )
-    cv2.imwrite("something.png", suh)
+    cv2.imwrite(image_path, drawn)
+    return matches
 
 
 def size(image_path):
     """
     Gets the size of an image.
-    :param image_path: The path to the image.
+    :param image_path: The path to the image, or the image as numpy array.
     :return: The width and height of the image.
     """
-    img = cv2.imread(image_path)
-    height, width, _ = img.shape
+    if not isinstance(image_path, np.ndarray):
+        with open(__image_path(image_path, ""), "rb") as file:
+            header = file.read(24)
+        if header[:8] == b"\x89PNG\r\n\x1a\n":
+            return size_from_bytes(header)
+    img = load_image(image_path)
+    height, width = img.shape[:2]
     return width, height
 
 
@@ -387,17 +2486,94 @@ class ImageRecognition:
 
     def __init__(
         self,
-        original: str,
+        original,
         comparison="",
         threshold=0.9,
         device_name="Device",
         path="./logs",
+        region=None,
+        device_udid=None,
+        profile=None,
+        cache=False,
     ):
+        """
+        :param original: image to search in, path or numpy array
+        :param comparison: image to search for, path or numpy array
+        :param threshold: limit to consider image as a match (0 to 1)
+        :param device_name: device name used in the logs
+        :param path: directory where relative paths are looked up
+        :param region: region of interest of the original image, as a
+        (x, y, width, height) rectangle or an element whose bounds are used
+        :param device_udid: device the original image comes from. When given,
+        the scale at which the image is found is remembered for the next
+        searches on the same device and screen size
+        :param profile: "fast" (grayscale at half resolution), "balanced"
+        (grayscale), "exact" (color, the default), "features" (ORB keypoints)
+        or a MatchProfile
+        :param cache: return the previous result when the same image is
+        searched again in an identical screen, see screen_hash
+        """
         self.__original = original
         self.__comparison = comparison
         self.__threshold = threshold
         self.__device_name = device_name
         self.__path = path
+        self.__region = region
+        self.__device_udid = device_udid
+        self.__profile = profile
+        self.__cache = cache
+
+    @staticmethod
+    def template_cache_stats() -> dict:
+        """
+        Hits, misses and evictions of the cache of reference images
+        :return: dict
+        """
+        return template_cache.stats()
+
+    @staticmethod
+    def result_cache_stats() -> dict:
+        """
+        Hits and misses of the cache of results in unchanged screens
+        :return: dict
+        """
+        return result_cache.stats()
+
+    @staticmethod
+    def load_scale_memo(path: str):
+        """
+        Loads the scales remembered in previous sessions
+        :param path: path to the JSON file
+        """
+        scale_memo.load(path)
+
+    @staticmethod
+    def save_scale_memo(path: str):
+        """
+        Saves the remembered scales for the next sessions
+        :param path: path to the JSON file
+        """
+        scale_memo.save(path)
+
+    @staticmethod
+    def add_telemetry_hook(hook):
+        """
+        Calls the hook after every image search with a dict of its stats:
+        "operation", "template", "image_size", "template_size", "threshold",
+        "profile", "scales" evaluated, "exit_scale" where it stopped early,
+        "frames" evaluated in videos, "score", "found", "duration" in seconds
+        and the "cache" hits
+        :param hook: function receiving a dict
+        """
+        telemetry.add(hook)
+
+    @staticmethod
+    def remove_telemetry_hook(hook):
+        """
+        Stops calling a hook added with add_telemetry_hook
+        :param hook: function previously added
+        """
+        telemetry.remove(hook)
 
     def compare(self, image_match="", max_scale=2.0, min_scale=0.3):
         """
@@ -415,47 +2591,68 @@ class ImageRecognition:
             max_scale,
             min_scale,
             self.__path,
+            self.__region,
+            self.__device_udid,
+            self.__profile,
+            self.__cache,
         )
         if self.__threshold > p1:
             logger.log_debug(
                 f"{self.__device_name}: Image match not found between: "
-                f"{self.__original} and {self.__comparison}. "
+                f"{describe_image(self.__original)} and "
+                f"{describe_image(self.__comparison)}. "
                 f"Threshold={self.__threshold}, matched = {p1}"
             )
             return False, p1
 
         logger.log_debug(
             f"{self.__device_name}: Image match found between: "
-            f"{self.__original} and {self.__comparison}. "
+            f"{describe_image(self.__original)} and "
+            f"{describe_image(self.__comparison)}. "
             f"Threshold={self.__threshold}, matched = {p1}"
         )
         return True, p1
 
     def compare_video(
-        self, image_match="", frame_rate_reduction=1, max_scale=2.0
+        self, image_match="", frame_rate_reduction=1, max_scale=2.0, processes=0
     ):
         """
         Compares the image to a video
         :param image_match: The image to match
         :param frame_rate_reduction: The frame rate reduction
         :param max_scale: The max scale
+        :param processes: If not 0, the frames are matched in a pool of that
+        many processes. None uses one process per CPU.
         :return: True if the image is found in the video
         """
-
-        found, p = compare_video_image(
-            self.__original,
-            self.__comparison,
-            self.__threshold,
-            image_match,
-            frame_rate_reduction,
-            max_scale,
-            self.__path,
-        )
+        frame = None
+        if processes == 0:
+            found, p = compare_video_image(
+                self.__original,
+                self.__comparison,
+                self.__threshold,
+                image_match,
+                frame_rate_reduction,
+                max_scale,
+                self.__path,
+            )
+        else:
+            found, p, frame = compare_video_image_parallel(
+                self.__original,
+                self.__comparison,
+                self.__threshold,
+                image_match,
+                frame_rate_reduction,
+                max_scale,
+                self.__path,
+                processes,
+            )
         if found:
             logger.log_debug(
                 f"{self.__device_name}: Image match found between "
                 f"video: {self.__original} and image {self.__comparison}. "
                 f"Threshold={self.__threshold}, matched = {p}"
+                + ("" if frame is None else f", frame = {frame}")
             )
             return True
 
@@ -468,16 +2665,42 @@ class ImageRecognition:
 
     def get_middle_point(self):
         """
-        Returns the middle point of the image match
-        :return: ImageRecognition
+        Returns the middle point of the image match, or of the region with
+        the highest similarity if there is no match
+        :return: (x, y) tuple
         """
-        get_point_match(
+        return get_point_match(
             self.__original,
             self.__comparison,
             self.__threshold,
             self.__device_name,
+            self.__region,
+            self.__device_udid,
+            self.__profile,
+            self.__cache,
+        )
+
+    def get_matches(self, max_scale=2.0, min_scale=0.3):
+        """
+        Returns all the occurrences of the image, see find_matches
+        :param max_scale: The maximum scale to compare the image to.
+        :param min_scale: The minimum scale to compare the image to.
+        :return: list of ImageMatch, top to bottom and left to right
+        """
+        stats = MatchStats("get_matches", self.__threshold, self.__profile)
+        template = load_template(self.__comparison, self.__path, stats)
+        image = load_image(self.__original, self.__path)
+        stats.describe(self.__comparison, image, template)
+        return find_matches(
+            image,
+            template,
+            self.__threshold,
+            max_scale,
+            min_scale,
+            self.__region,
+            self.__profile,
+            stats=stats,
         )
-        return self
 
     def draw_image_match(self):
         """
@@ -498,9 +2721,9 @@ class ImageRecognition:
         :return: Dimensions
         """
         path = self.__original
-        if self.__path != "":
+        if self.__path != "" and not isinstance(path, np.ndarray):
             path = os.path.join(self.__path, self.__original)
-        logger.log(f"Checking size of image: {path}")
+        logger.log(f"Checking size of image: {describe_image(path)}")
         size_image = size(path)
         logger.log(f"The size of the image is {size_image}")
         return Dimensions(size_image[0], size_image[1])
@@ -526,9 +2749,9 @@ class ImageRecognition:
         :param image_name: str
         :return: ImageRecognition
         """
-        # Read the images from the file
-        path = os.path.join(self.__path, self.__original)
-        img = cv2.imread(path)
+        img = self.__original
+        if not isinstance(img, np.ndarray):
+            img = cv2.imread(os.path.join(self.__path, self.__original))
         y = center_y - height // 2
         if y < 0:
             y *= -1
@@ -542,6 +2765,7 @@ class ImageRecognition:
 
 class Dimensions:
     """Class to store the dimensions of an image"""
+
     def __init__(self, x, y):
         self.x = x
         self.y = y